@@ -13,11 +13,12 @@ c.lhs = c.identifier
 # ideally, we would define c.rhs and be done with it.
 # c.rhs = c.identifier | c.terminal | "[" + c.rhs + "]" | "{" + c.rhs + "}"\
 #     | "(" + c.rhs + ")" | c.rhs + "|" + c.rhs | c.rhs + "," + c.rhs
-# however, to avoid infinite recursion, we must get creative and remove recursion
+# however, the last two alternatives are left recursive, which would recurse
+# forever. instead, `|` and `,` are parsed as operators, with `,` binding tighter
 c.seq = "[" + c.rhs + "]" | "{" + c.rhs + "}" | "(" + c.rhs + ")"
 c.rhs_term = c.identifier | c.terminal
 c.rhs_front = c.seq | c.rhs_term
-c.rhs = c.rhs_front + [(b("|") | ",") + c.rhs]
+c.rhs = b.expression(c.rhs_front, infix={"|": 1, ",": 2})
 c.rule = c.lhs + "=" + c.rhs + ";"
 c.grammar = c.rule[:]["rules[]"] + b.EOS
 
@@ -1 +1 @@
-from .builder import grammar, Grammar, ParseError
\ No newline at end of file
+from .builder import grammar, Grammar, ParseError, ParseLimitError, seal
\ No newline at end of file
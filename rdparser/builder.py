@@ -1,16 +1,32 @@
 import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from .rules import *
-from .nodes import NodeInspector
+from .nodes import NodeInspector, LazyNode
+from .recognizer import Recognizer
 
 
 class Grammar:
     def __init__(self, comment_rule=None, raw_comment_rule=None):
         self.rules = {}
+        # rules wrapped in the comment rule, built once so every access to a
+        # rule returns the same object (recognizers are cached by rule)
+        self.wrapped = {}
         if comment_rule is not None:
             comment_rule = Grammar.builder(comment_rule).silent()[:]
         self.comment_rule = comment_rule or raw_comment_rule
         self.context = GrammarContext(self)
         self.builder = RuleBuilder(None, self.comment_rule)
+        self.sealed = False
+
+    def seal(self):
+        missing = [name for name, rule in self.rules.items() if rule.rule is None]
+        if missing:
+            raise RuntimeError("rules {} were forward declared, but never given a value".format(", ".join(missing)))
+        for rule in self.rules.values():
+            rule.sealed = True
+        self.sealed = True
 
     # placeholder for RuleBuilder
     builder = None
@@ -22,6 +38,11 @@ def grammar(comment_rule=None, raw_comment_rule=None):
 # placeholder for RuleBuilder
 grammar.builder = None
 
+def seal(context):
+    if isinstance(context, GrammarContext):
+        context = context._grammar
+    context.seal()
+
 class GrammarContext:
     def __init__(self, grammar):
         super().__setattr__("_grammar", grammar)
@@ -30,12 +51,17 @@ class GrammarContext:
         g = self._grammar
         rules = g.rules
         if name not in rules:
+            if g.sealed:
+                raise AttributeError("grammar is sealed and has no rule named `{}`".format(name))
             rule = Rule(name)
             rules[name] = rule
         if raw or g.comment_rule is None:
             return g.builder(rules[name])
-        else:
-            return g.builder(Join((g.comment_rule.rule, rules[name], g.comment_rule.rule)))
+        wrapped = g.wrapped.get(name)
+        if wrapped is None:
+            wrapped = Join((g.comment_rule.rule, rules[name], g.comment_rule.rule))
+            g.wrapped[name] = wrapped
+        return g.builder(wrapped)
 
     def __setattr__(self, name, value):
         rule = self.__getattr__(name, True).rule
@@ -59,18 +85,57 @@ class RuleBuilder:
     def silent(self):
         return self._wrap(Silent(self.rule))
 
-    def parse(self, source, offset=0, explicit_new_lines=None):
+    def balanced(self, open, close, ignore=None):
+        if isinstance(ignore, str):
+            ignore = re.compile(ignore)
+        return self._wrap(Balanced(open, close, ignore))
+
+    def lazy(self, name, scanner):
+        return self._wrap(Lazy(self.rule, self.unwrap(scanner), name))
+
+    def expression(self, operand, infix=None, prefix=None, postfix=None):
+        return self._wrap(Expression(self.unwrap(operand), _operators(infix), _operators(prefix),
+            _operators(postfix), self.comment_rule))
+
+    def parse(self, source, offset=0, explicit_new_lines=None, profile=None, limits=None):
         rule = self.rule
-        old_flag_value = use_explicit_new_lines()
-        use_explicit_new_lines(explicit_new_lines)
+        context = ParseContext(explicit_new_lines, profile, limits)
+        nodes = []
         try:
-            nodes = []
-            offset, error = rule.match(source, offset, nodes)
+            offset, error = rule.match(source, offset, nodes, context)
             return offset, NodeInspector(nodes[0]).mask
         except RuleError as e:
             raise ParseError(e, source, NodeInspector(nodes[0]).mask) from e
-        finally:
-            use_explicit_new_lines(old_flag_value)
+        except LimitError as e:
+            # a limit can be hit before the first node is created
+            node = NodeInspector(nodes[0]).mask if nodes else None
+            raise ParseLimitError(e, source, node) from e
+
+    def parse_many(self, sources, offset=0, explicit_new_lines=None, max_workers=None, profile=None, limits=None):
+        def parse(source):
+            return self.parse(source, offset, explicit_new_lines, profile, limits)
+        with ThreadPoolExecutor(max_workers) as pool:
+            return list(pool.map(parse, sources))
+
+    def recognizer(self, explicit_new_lines=None):
+        if explicit_new_lines is None:
+            explicit_new_lines = use_explicit_new_lines()
+        rule = self.rule
+        assignments = Rule.assignments
+        with _recognizers_lock:
+            cached = _recognizers.get(rule, {}).get(explicit_new_lines)
+        # a rule assigned since the recognizer was built may be part of it
+        if cached is not None and cached[0] == assignments:
+            return cached[1]
+        recognizer = Recognizer(rule, explicit_new_lines)
+        # don't keep a recognizer built before the grammar was finished
+        if recognizer.complete:
+            with _recognizers_lock:
+                _recognizers.setdefault(rule, {})[explicit_new_lines] = (assignments, recognizer)
+        return recognizer
+
+    def recognize(self, source, offset=0, explicit_new_lines=None):
+        return self.recognizer(explicit_new_lines).recognize(source, offset)
 
     def parse_or_print(self, source, offset=0, explicit_new_lines=None):
         try:
@@ -164,6 +229,26 @@ class RuleBuilder:
 Grammar.builder = RuleBuilder()
 grammar.builder = RuleBuilder()
 
+def _operators(table):
+    # an operator table maps each operator (a string or a rule) to its
+    # precedence, or to a tuple of precedence and "left" or "right"
+    operators = []
+    for operator, precedence in (table or {}).items():
+        associativity = "left"
+        if isinstance(precedence, tuple):
+            precedence, associativity = precedence
+        if associativity not in ("left", "right"):
+            raise ValueError("associativity should be \"left\" or \"right\", not {!r}".format(associativity))
+        if not isinstance(operator, str):
+            operator = RuleBuilder.unwrap(operator)
+        operators.append((operator, precedence, associativity == "right"))
+    return operators
+
+# recognizers built by RuleBuilder.recognizer, for each rule and new line mode,
+# with the value of Rule.assignments when they were built
+_recognizers = weakref.WeakKeyDictionary()
+_recognizers_lock = threading.Lock()
+
 
 class ParseError(Exception):
     def __init__(self, rule_error, source, node):
@@ -201,3 +286,22 @@ class ParseError(Exception):
         elif isinstance(error, PredicateError):
             message = "predicate matched " + error.offending_rule.predicate
         print("{}: {}".format(error_name, message))
+
+class ParseLimitError(ParseError):
+    @property
+    def limit(self):
+        return self.rule_error.limit
+
+    @property
+    def rules(self):
+        return self.rule_error.rules
+
+def _lazy_parse_error(error, source, root):
+    node = NodeInspector(root).mask
+    if isinstance(error, LimitError):
+        return ParseLimitError(error, source, node)
+    elif isinstance(error, RuleError):
+        return ParseError(error, source, node)
+    return error
+
+LazyNode.parse_error = staticmethod(_lazy_parse_error)
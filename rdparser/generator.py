@@ -0,0 +1,333 @@
+import io
+import math
+import random
+import string
+from .rules import *
+from .rules import iter_rule
+from .builder import RuleBuilder
+from .util import sre_parse, _CATEGORIES, _REPEATS, _ZERO_WIDTH
+
+_ALPHABET = string.ascii_letters + string.digits + string.punctuation + " "
+_flush_size = 1024
+_attempts = 32
+
+
+def _min_depths(rule):
+    # the fewest nested named rules needed to generate any text for each rule,
+    # solved as a fixed point since grammars may be recursive
+    rules = {}
+    stack = [rule]
+    while stack:
+        rule = stack.pop()
+        if id(rule) in rules:
+            continue
+        rules[id(rule)] = rule
+        if not isinstance(rule, Rule) or rule.rule is not None:
+            stack.extend(iter_rule(rule))
+    depths = dict.fromkeys(rules, math.inf)
+    changed = True
+    while changed:
+        changed = False
+        for key, rule in rules.items():
+            if isinstance(rule, Rule) and rule.rule is None:
+                continue
+            children = [depths[id(r)] for r in iter_rule(rule)]
+            if isinstance(rule, (Rule, Lazy)):
+                depth = 1 + children[0]
+            elif isinstance(rule, Join):
+                depth = max(children, default=0)
+            elif isinstance(rule, Choice):
+                depth = min(children, default=math.inf)
+            elif isinstance(rule, Repeat):
+                depth = children[0] if rule._min else 0
+            elif isinstance(rule, (Silent, Predicate, Expression)):
+                depth = children[0]
+            else:
+                depth = 0
+            if depth < depths[key]:
+                depths[key] = depth
+                changed = True
+    return depths
+
+
+def _find_driver(rule):
+    # the first unbounded repeat reachable from the root, ignoring silenced
+    # rules since those are usually comments, not the body of the document
+    queue = [rule]
+    seen = set()
+    for rule in queue:
+        if id(rule) in seen or isinstance(rule, Silent) or (isinstance(rule, Rule) and rule.rule is None):
+            continue
+        seen.add(id(rule))
+        if isinstance(rule, Repeat) and rule._max is None and not isinstance(rule.rule, Silent):
+            return rule
+        elif isinstance(rule, (Predicate, Lazy)):
+            queue.append(rule.rule)
+        else:
+            queue.extend(iter_rule(rule))
+    return None
+
+
+def _simplify(items):
+    # replace the parser's SubPattern objects with lists, which are much
+    # faster to iterate over
+    simplified = []
+    for op, av in items:
+        if op is sre_parse.BRANCH:
+            av = (av[0], [_simplify(branch) for branch in av[1]])
+        elif op is sre_parse.SUBPATTERN:
+            av = av[:3] + (_simplify(av[3]),)
+        elif op in _REPEATS:
+            av = av[:2] + (_simplify(av[2]),)
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            av = _simplify(av)
+        elif op is sre_parse.IN:
+            av = list(av)
+        simplified.append((op, av))
+    return simplified
+
+
+class _RegexSampler:
+    def __init__(self, random, max_repeat):
+        self.random = random
+        self.max_repeat = max_repeat
+        self.patterns = {}
+        self.chars = {}
+
+    def sample(self, expression):
+        pattern = self.patterns.get(expression)
+        if pattern is None:
+            pattern = _simplify(sre_parse.parse(expression.pattern, expression.flags))
+            self.patterns[expression] = pattern
+        self.groups = {}
+        out = []
+        self._sample(pattern, out)
+        return "".join(out)
+
+    def _sample(self, items, out):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                out.append(chr(av))
+            elif op is sre_parse.NOT_LITERAL:
+                out.append(self._char(("literal", av), lambda c: ord(c) != av))
+            elif op is sre_parse.ANY:
+                out.append(self.random.choice(_ALPHABET))
+            elif op is sre_parse.IN:
+                out.append(self._sample_in(av))
+            elif op is sre_parse.BRANCH:
+                self._sample(self.random.choice(av[1]), out)
+            elif op is sre_parse.SUBPATTERN:
+                group, add_flags, del_flags, pattern = av
+                start = len(out)
+                self._sample(pattern, out)
+                if group is not None:
+                    self.groups[group] = "".join(out[start:])
+            elif op in _REPEATS:
+                _min, _max, pattern = av
+                _max = min(_max, _min + self.max_repeat)
+                for i in range(self.random.randint(_min, _max)):
+                    self._sample(pattern, out)
+            elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+                self._sample(av, out)
+            elif op is sre_parse.GROUPREF:
+                out.append(self.groups.get(av, ""))
+            elif op in _ZERO_WIDTH:
+                pass
+            else:
+                raise ValueError("can't sample regex containing {}".format(op))
+
+    def _char(self, key, accept):
+        # the characters of a class are found once, then sampled directly
+        chars = self.chars.get(key)
+        if chars is None:
+            chars = [char for char in _ALPHABET if accept(char)]
+            self.chars[key] = chars
+        if not chars:
+            raise ValueError("failed to sample a character for regex")
+        return self.random.choice(chars)
+
+    def _sample_in(self, items):
+        if items[0][0] is sre_parse.NEGATE:
+            return self._char(("class", id(items)), lambda c: not _in_class(items[1:], c))
+        op, av = self.random.choice(items)
+        if op is sre_parse.LITERAL:
+            return chr(av)
+        elif op is sre_parse.RANGE:
+            return chr(self.random.randint(*av))
+        return self._char(("category", av), _CATEGORIES[av].match)
+
+def _in_class(items, char):
+    code = ord(char)
+    for op, av in items:
+        if op is sre_parse.LITERAL and code == av:
+            return True
+        elif op is sre_parse.RANGE and av[0] <= code <= av[1]:
+            return True
+        elif op is sre_parse.CATEGORY and _CATEGORIES[av].match(char):
+            return True
+    return False
+
+
+class CorpusGenerator:
+    def __init__(self, rule, seed=None, max_depth=16, max_repeat=4, separator=" ", regex_samples=None):
+        self.rule = RuleBuilder.unwrap(rule)
+        self.random = random.Random(seed)
+        self.max_depth = max_depth
+        self.max_repeat = max_repeat
+        self.separator = separator
+        self.regex_samples = dict(regex_samples or {})
+        self._sampler = _RegexSampler(self.random, max_repeat)
+        self._depths = _min_depths(self.rule)
+        self._driver = _find_driver(self.rule)
+
+    def generate(self, fp, size=0):
+        self._fp = fp
+        self._buffer = []
+        self._written = 0
+        self._size = size
+        self._capturing = 0
+        self._driving = False
+        self._emit(self.rule, 0)
+        fp.write("".join(self._buffer))
+        return self._written
+
+    def generate_string(self, size=0):
+        fp = io.StringIO()
+        self.generate(fp, size)
+        return fp.getvalue()
+
+    def _write(self, text):
+        self._buffer.append(text)
+        self._written += len(text)
+        if len(self._buffer) >= _flush_size and not self._capturing:
+            self._fp.write("".join(self._buffer))
+            self._buffer.clear()
+
+    def _emit(self, rule, depth):
+        if isinstance(rule, Rule):
+            if rule.rule is None:
+                raise RuntimeError("rule `{}` was forward declared, but never given a value with assign_rule()".format(rule.name))
+            self._emit(rule.rule, depth + 1)
+        elif isinstance(rule, Join):
+            for r in rule.rules:
+                self._emit(r, depth)
+        elif isinstance(rule, Choice):
+            remaining = self.max_depth - depth
+            depths = self._depths
+            options = [r for r in rule.rules if depths[id(r)] <= remaining]
+            if not options:
+                options = [min(rule.rules, key=lambda r: depths[id(r)])]
+            self._emit(self.random.choice(options), depth)
+        elif isinstance(rule, Repeat):
+            self._emit_repeat(rule, depth)
+        elif isinstance(rule, Predicate):
+            self._emit_predicate(rule, depth)
+        elif isinstance(rule, Silent):
+            self._emit(rule.rule, depth)
+        elif isinstance(rule, Lazy):
+            # the scanner has to accept whatever the rule does
+            self._emit(rule.rule, depth + 1)
+        elif isinstance(rule, Expression):
+            self._emit_expression(rule, depth)
+        elif isinstance(rule, Balanced):
+            text = rule.open + rule.close
+            self._write(self.separator + text if rule.ignore_whitespace else text)
+        elif isinstance(rule, Terminal):
+            self._write(self.separator + rule.terminal if rule.ignore_whitespace else rule.terminal)
+        elif isinstance(rule, Regex):
+            text = self._sample_regex(rule.expression)
+            self._write(self.separator + text if rule.ignore_whitespace else text)
+        elif not isinstance(rule, (Empty, EndOfStream)):
+            raise TypeError("can't generate text for " + rule.__class__.__name__)
+
+    def _emit_repeat(self, rule, depth):
+        _min = rule._min or 0
+        _max = rule._max
+        if self._depths[id(rule.rule)] > self.max_depth - depth:
+            count = _min
+        elif rule is self._driver and not self._driving and self._written < self._size:
+            # the outermost document level repeat keeps going until the target
+            # size is reached, everything nested inside it stays small
+            self._driving = True
+            try:
+                count = 0
+                while count < _min or self._written < self._size:
+                    if not self._emit_once(rule.rule, depth):
+                        break
+                    count += 1
+            finally:
+                self._driving = False
+            return
+        else:
+            upper = _min + self.max_repeat
+            count = self.random.randint(_min, upper if _max is None else min(_max, upper))
+        for i in range(count):
+            if not self._emit_once(rule.rule, depth) and i >= _min:
+                break
+
+    def _emit_once(self, rule, depth):
+        # matching an empty repetition is an error, so report if nothing was written
+        written = self._written
+        self._emit(rule, depth)
+        return self._written != written
+
+    def _emit_expression(self, rule, depth):
+        # operands joined by random infix operators, each sometimes with a
+        # prefix or postfix operator
+        count = 0
+        if rule.infix.operators and self._depths[id(rule.operand)] <= self.max_depth - depth:
+            count = self.random.randint(0, self.max_repeat)
+        for i in range(count + 1):
+            if i:
+                self._emit_operator(rule, rule.infix, depth)
+            if rule.prefix.operators and self.random.random() < 0.25:
+                self._emit_operator(rule, rule.prefix, depth)
+            self._emit(rule.operand, depth)
+            if rule.postfix.operators and self.random.random() < 0.25:
+                self._emit_operator(rule, rule.postfix, depth)
+
+    def _emit_operator(self, rule, table, depth):
+        if rule.separator is not None:
+            self._emit(rule.separator, depth)
+        operator = self.random.choice(table.operators)[0]
+        if isinstance(operator, str):
+            self._write(self.separator + operator)
+        else:
+            self._emit(operator, depth)
+
+    def _emit_predicate(self, rule, depth):
+        buffer = self._buffer
+        start = len(buffer)
+        written = self._written
+        self._capturing += 1
+        try:
+            for i in range(_attempts):
+                self._emit(rule.rule, depth)
+                text = "".join(buffer[start:])
+                try:
+                    rule.predicate.match(text, 0, [], ParseContext())
+                except RuleError:
+                    return
+                del buffer[start:]
+                self._written = written
+        finally:
+            self._capturing -= 1
+        raise RuntimeError("failed to generate text that doesn't match the predicate")
+
+    def _sample_regex(self, expression):
+        sample = self.regex_samples.get(expression.pattern)
+        if sample is not None:
+            return sample(self.random) if callable(sample) else self.random.choice(sample)
+        # an empty (or blank) match isn't reliable when whitespace is skipped,
+        # since the regex can match the text that follows instead, so avoid them
+        empty = None
+        for i in range(_attempts):
+            text = self._sampler.sample(expression)
+            result = expression.match(text)
+            if result and result.end() == len(text):
+                if text.strip():
+                    return text
+                empty = text
+        if empty is not None:
+            return empty
+        raise ValueError("failed to sample text matching regex `{}`, add it to regex_samples".format(expression.pattern))
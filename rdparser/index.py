@@ -0,0 +1,154 @@
+from functools import lru_cache
+from .builder import grammar, ParseError
+from .rules import Terminal
+from .nodes import Node, NodeInspector, NodeMask
+
+# the selector language is parsed with a grammar of its own
+_c, _b = grammar()
+_c.name = {r"[a-zA-Z_][a-zA-Z_0-9]*|\*"}
+# a filter must follow its name directly, since `a :first-child` would mean a
+# descendant of `a` in css
+_c.nth_child = _b(Terminal(":nth-child(", ignore_token=True, ignore_whitespace=False)) + _b({r"-?[1-9][0-9]*"}) + ")"
+_c.first_child = _b(Terminal(":first-child", ignore_whitespace=False))
+_c.last_child = _b(Terminal(":last-child", ignore_whitespace=False))
+_c.filter = _c.nth_child | _c.first_child | _c.last_child
+_c.compound = _c.name + _c.filter[:]["filters[]"]
+_c.step = [_b * ">"] + _c.compound
+_c.selector = _c.step[1:]["steps[]"]
+_selectors = (_c.selector + ("," + _c.selector)[:])["selectors[]"] + _b.EOS
+
+@lru_cache(maxsize=256)
+def _compile(selector):
+    try:
+        end, selectors = _selectors.parse(selector)
+    except ParseError as e:
+        raise ValueError("invalid selector `{}`: {}".format(selector, e)) from e
+    compiled = []
+    for steps in selectors:
+        compiled_steps = []
+        for step in steps.steps:
+            child = len(step) > 0
+            compound = step.compound
+            nth = []
+            for f in compound.filters:
+                if f.nth_child is not None:
+                    nth.append(int(f.nth_child[0].value))
+                elif f.first_child is not None:
+                    nth.append(1)
+                else:
+                    nth.append(-1)
+            compiled_steps.append((child, compound.name[0].value, tuple(nth)))
+        if compiled_steps[0][0]:
+            raise ValueError("invalid selector `{}`: can't start with `>`".format(selector))
+        compiled.append(tuple(compiled_steps))
+    return tuple(compiled)
+
+
+class TreeIndex:
+    def __init__(self, node):
+        if isinstance(node, NodeMask):
+            node = node._inspector.target
+        if not isinstance(node, Node):
+            raise TypeError("node should be an instance of Node or NodeMask, not " + node.__class__.__name__)
+        # named nodes in document order, with their parent, the index after
+        # their subtree, and their position among the named children of parent
+        self.nodes = []
+        self.parents = []
+        self.ends = []
+        self.positions = []
+        self.counts = []
+        self.names = {}
+        self._indices = {}
+        stack = [(node, -1, 1, 1)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, int):
+                self.ends[item] = len(self.nodes)
+                continue
+            node, parent, position, count = item
+            index = len(self.nodes)
+            self.nodes.append(node)
+            self.parents.append(parent)
+            self.ends.append(index + 1)
+            self.positions.append(position)
+            self.counts.append(count)
+            self._indices[id(node)] = index
+            if node.name in self.names:
+                self.names[node.name].append(index)
+            else:
+                self.names[node.name] = [index]
+            children = [child for child in node.nodes if isinstance(child, Node)]
+            if children:
+                stack.append(index)
+                count = len(children)
+                for position in range(count, 0, -1):
+                    stack.append((children[position - 1], index, position, count))
+
+    def index_of(self, node):
+        if isinstance(node, NodeMask):
+            node = node._inspector.target
+        return self._indices[id(node)]
+
+    def parent(self, node):
+        parent = self.parents[self.index_of(node)]
+        return None if parent < 0 else self.nodes[parent]
+
+    def descendants(self, node):
+        index = self.index_of(node)
+        return self.nodes[index + 1:self.ends[index]]
+
+    def find(self, name):
+        return [self.nodes[i] for i in self.names.get(name, ())]
+
+    def select_nodes(self, selector):
+        found = set()
+        for steps in _compile(selector):
+            # whether a node matches a prefix of the steps, so every pair of
+            # node and step is only checked once however deep the tree is
+            memo = {}
+            name = steps[-1][1]
+            if name == "*":
+                candidates = range(len(self.nodes))
+            else:
+                candidates = self.names.get(name, ())
+            for index in candidates:
+                if index not in found and self._match(index, steps, len(steps) - 1, memo):
+                    found.add(index)
+        return [self.nodes[i] for i in sorted(found)]
+
+    def select(self, selector):
+        return [NodeInspector(node).mask for node in self.select_nodes(selector)]
+
+    def _match_compound(self, index, name, nth):
+        if name != "*" and self.nodes[index].name != name:
+            return False
+        for n in nth:
+            if n < 0:
+                n += self.counts[index] + 1
+            if self.positions[index] != n:
+                return False
+        return True
+
+    def _match(self, index, steps, step, memo):
+        key = (index, step)
+        if key not in memo:
+            memo[key] = self._match_step(index, steps, step, memo)
+        return memo[key]
+
+    def _match_step(self, index, steps, step, memo):
+        child, name, nth = steps[step]
+        if not self._match_compound(index, name, nth):
+            return False
+        if step == 0:
+            return True
+        parents = self.parents
+        parent = parents[index]
+        while parent >= 0:
+            if self._match(parent, steps, step - 1, memo):
+                return True
+            # the child combinator looks through renamed rules (like
+            # `c.field[:]["fields[]"]`), the same as attribute access on NodeMask
+            if child and not self.nodes[parent].opts.get("flatten"):
+                return False
+            parent = parents[parent]
+        return False
@@ -12,6 +12,63 @@ class Node(BaseNode):
     def __as_dict__(self):
         return {"name": self.name, "nodes": [node.__as_dict__() for node in self.nodes]}
 
+class LazyNode(Node):
+    # a node whose children are parsed by a Lazy rule when they're first used,
+    # caching the result or the error
+    def __init__(self, offset, name, rule, source, settings, **opts):
+        self.offset = offset
+        self.end_offset = None
+        self.name = name
+        self.opts = opts
+        self._nodes = None
+        self._error = None
+        self._rule = rule
+        self._source = source
+        self._settings = settings
+        # where the region starts in _source, and how far its nodes were moved
+        # since (by parse_parallel)
+        self._start = offset
+        self._delta = 0
+
+    # placeholder for the frontend's function that turns an error raised while
+    # parsing the region into a ParseError, set by rdparser.builder
+    parse_error = None
+
+    @property
+    def loaded(self):
+        return self._nodes is not None
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            if self._error is None:
+                try:
+                    self._load()
+                except Exception as e:
+                    self._error = e
+            if self._error is not None:
+                raise self._error
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self._nodes = nodes
+
+    def _load(self):
+        root = Node(self._start, self.name, **self.opts)
+        try:
+            self._rule.load(self._source, self._start, self._settings, root.nodes)
+        except Exception as e:
+            error = LazyNode.parse_error(e, self._source, root)
+            if error is e:
+                raise
+            raise error from e
+        nodes = root.nodes
+        _shift_offsets(nodes, self._delta)
+        _rebase_start(nodes, self._start + self._delta, self.offset)
+        self._nodes = nodes
+        self._source = None
+
 class Token(BaseNode):
     def __init__(self, offset, value):
         self.offset = offset
@@ -21,6 +78,30 @@ class Token(BaseNode):
         return {"offset": self.offset, "value": self.value}
 
 
+def _shift_offsets(nodes, delta):
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        node.offset += delta
+        if isinstance(node, Node):
+            if node.end_offset is not None:
+                node.end_offset += delta
+            if isinstance(node, LazyNode) and not node.loaded:
+                # moved again when it's loaded
+                node._delta += delta
+            else:
+                stack.extend(node.nodes)
+
+def _rebase_start(nodes, begin, offset):
+    # move the left edge of a tree starting at `begin` to `offset`, the same
+    # way parsing from `offset` and skipping whitespace would have
+    while nodes and isinstance(nodes[0], Node) and nodes[0].offset == begin:
+        nodes[0].offset = offset
+        if isinstance(nodes[0], LazyNode) and not nodes[0].loaded:
+            break
+        nodes = nodes[0].nodes
+
+
 class NodeInspector:
     def __init__(self, target):
         if not isinstance(target, Node):
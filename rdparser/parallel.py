@@ -0,0 +1,146 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from .rules import *
+from .rules import _skip_whitespace
+from .nodes import Node, NodeInspector, _shift_offsets, _rebase_start
+from .builder import RuleBuilder, ParseError
+
+# state of a worker process, set once by _init_worker so the grammar is only
+# pickled once per process instead of once per chunk
+_chunk_rule = None
+_explicit_new_lines = None
+
+def _init_worker(rule, explicit_new_lines):
+    global _chunk_rule, _explicit_new_lines
+    _chunk_rule = rule
+    _explicit_new_lines = explicit_new_lines
+
+def _parse_chunk(task):
+    return _match_chunk(_chunk_rule, _explicit_new_lines, task)
+
+def _match_chunk(rule, explicit_new_lines, task):
+    # match items like Repeat(rule), but also return where the last item
+    # started, and its index in the nodes
+    text, start = task
+    context = ParseContext(explicit_new_lines)
+    nodes = []
+    offset = 0
+    last = None
+    try:
+        while True:
+            new_nodes = []
+            try:
+                new_offset, error = rule.match(text, offset, new_nodes, context)
+            except RuleError:
+                break
+            if new_offset == offset:
+                raise RuntimeError("infinite loop detected while parsing items")
+            last = (offset + start, len(nodes))
+            nodes.extend(new_nodes)
+            offset = new_offset
+        EndOfStream().match(text, offset, [], context)
+    except RuleError:
+        return None
+    _shift_offsets(nodes, start)
+    return offset + start, nodes, last
+
+def _unwrap_sync(sync):
+    if isinstance(sync, re.Pattern):
+        return Regex(sync)
+    if isinstance(sync, set):
+        # unwrap pops the pattern, so don't empty the caller's set
+        sync = set(sync)
+    return RuleBuilder.unwrap(sync)
+
+def _find_sync(source, sync, offset, context):
+    if isinstance(sync, Regex):
+        result = sync.expression.search(source, offset)
+        return result.start() if result else None
+    elif isinstance(sync, Terminal):
+        offset = source.find(sync.terminal, offset)
+        return offset if offset >= 0 else None
+    # any other rule is tried at every offset, which is slow but always works
+    for offset in range(offset, len(source)):
+        try:
+            sync.match(source, offset, [], context)
+            return offset
+        except RuleError:
+            pass
+    return None
+
+def _split(source, sync, offset, chunk_size, context):
+    bounds = [offset]
+    while True:
+        offset = _find_sync(source, sync, bounds[-1] + chunk_size, context)
+        if offset is None or offset >= len(source):
+            break
+        bounds.append(offset)
+    bounds.append(len(source))
+    return bounds
+
+def _parse_sequential(rule, source, offset, end, nodes, context):
+    while _skip_whitespace(source, offset, context) < end:
+        _offset = offset
+        new_nodes = []
+        try:
+            offset, error = rule.match(source, offset, new_nodes, context)
+        finally:
+            nodes.extend(new_nodes)
+        if _offset == offset:
+            raise RuntimeError("infinite loop detected while parsing items")
+    return offset
+
+def _ends_at(rule, source, offset, end, context):
+    try:
+        return rule.match(source, offset, [], context)[0] == end
+    except RuleError:
+        return False
+
+def _stitch(rule, source, bounds, results, nodes, context):
+    offset = bounds[0]
+    for i, result in enumerate(results):
+        begin, end = bounds[i], bounds[i + 1]
+        if result is not None and _skip_whitespace(source, offset, context) == _skip_whitespace(source, begin, context):
+            _offset, result, last = result
+            _rebase_start(result, begin, offset)
+            if last is not None and end < len(source):
+                # a split inside an item (like in a trailing comment) can still
+                # leave a chunk that parses, so check its last item ends at
+                # the same offset in the whole source
+                start, index = last
+                if index == 0:
+                    start = offset
+                if not _ends_at(rule, source, start, _offset, context):
+                    nodes.extend(result[:index])
+                    offset = _parse_sequential(rule, source, start, end, nodes, context)
+                    continue
+            nodes.extend(result)
+            offset = _offset
+        elif offset < end:
+            # the chunk failed, or it doesn't start where the previous item
+            # ended, so re-parse its items in order on the whole source
+            offset = _parse_sequential(rule, source, offset, end, nodes, context)
+    return offset
+
+def parse_parallel(item, source, sync, name="", offset=0, chunk_size=1 << 20, max_workers=None, explicit_new_lines=None):
+    rule = RuleBuilder.unwrap(item)
+    sync = _unwrap_sync(sync)
+    context = ParseContext(explicit_new_lines)
+    if name.endswith("[]"):
+        root = Node(offset, name[:-2], flatten=True, as_list=True)
+    else:
+        root = Node(offset, name)
+    bounds = _split(source, sync, offset, chunk_size, context)
+    tasks = ((source[begin:end], begin) for begin, end in zip(bounds, bounds[1:]))
+    try:
+        if max_workers == 1 or len(bounds) <= 2:
+            results = (_match_chunk(rule, context.explicit_new_lines, task) for task in tasks)
+            _stitch(rule, source, bounds, results, root.nodes, context)
+        else:
+            initargs = (rule, context.explicit_new_lines)
+            with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=initargs) as pool:
+                _stitch(rule, source, bounds, pool.map(_parse_chunk, tasks), root.nodes, context)
+    except RuleError as e:
+        raise ParseError(e, source, NodeInspector(root).mask) from e
+    root.end_offset = len(source)
+    return root.end_offset, NodeInspector(root).mask
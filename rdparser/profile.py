@@ -0,0 +1,521 @@
+import re
+from .rules import *
+from .rules import iter_rule
+from .builder import RuleBuilder
+from .util import sre_parse, _CATEGORIES, _REPEATS, _ZERO_WIDTH
+
+# pairs of categories without a character in common
+_DISJOINT_CATEGORIES = {frozenset(pair) for pair in (
+    (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_DIGIT),
+    (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_SPACE),
+    (sre_parse.CATEGORY_WORD, sre_parse.CATEGORY_NOT_WORD),
+    (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_SPACE),
+    (sre_parse.CATEGORY_WORD, sre_parse.CATEGORY_SPACE),
+    (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_WORD),
+)}
+_max_range = 256
+_max_copies = 8
+_max_stack = 64
+_max_pairs = 10000
+
+
+class _CharSet:
+    # a superset of the characters an edge accepts, with some precision lost
+    # for negated classes and large ranges
+    __slots__ = ("chars", "categories", "any")
+
+    def __init__(self, chars=(), categories=(), any=False):
+        self.chars = frozenset(chars)
+        self.categories = frozenset(categories)
+        self.any = any
+
+    def disjoint(self, other):
+        if not (self.chars or self.categories or self.any) or not (other.chars or other.categories or other.any):
+            return True
+        if self.any or other.any or self.chars & other.chars:
+            return False
+        for a, b in ((self, other), (other, self)):
+            for category in b.categories:
+                expression = _CATEGORIES[category]
+                if any(expression.match(chr(char)) for char in a.chars):
+                    return False
+        for a in self.categories:
+            for b in other.categories:
+                if frozenset((a, b)) not in _DISJOINT_CATEGORIES:
+                    return False
+        return True
+
+_ANY = _CharSet(any=True)
+_WHITESPACE = _CharSet(categories=(sre_parse.CATEGORY_SPACE,))
+
+
+class _Unsupported(Exception):
+    pass
+
+class _NFA:
+    def __init__(self):
+        self.edges = []
+        self.eps = []
+
+    def state(self):
+        self.edges.append([])
+        self.eps.append([])
+        return len(self.edges) - 1
+
+    def build(self, items, skip, ignorecase, ascii):
+        self.start = self.state()
+        if skip:
+            self.edges[self.start].append((_WHITESPACE, self.start))
+        self.final = self._sequence(items, self.start, ignorecase, ascii)
+        return self
+
+    def _sequence(self, items, state, ignorecase, ascii):
+        for op, av in items:
+            state = self._item(op, av, state, ignorecase, ascii)
+        return state
+
+    def _item(self, op, av, state, ignorecase, ascii):
+        if op is sre_parse.LITERAL or op is sre_parse.IN or op is sre_parse.NOT_LITERAL or op is sre_parse.ANY:
+            end = self.state()
+            self.edges[state].append((_charset(op, av, ignorecase, ascii), end))
+            return end
+        elif op is sre_parse.BRANCH:
+            end = self.state()
+            for branch in av[1]:
+                start = self.state()
+                self.eps[state].append(start)
+                self.eps[self._sequence(branch, start, ignorecase, ascii)].append(end)
+            return end
+        elif op is sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, pattern = av
+            if add_flags & re.IGNORECASE:
+                ignorecase = True
+            if add_flags & (re.ASCII | re.LOCALE):
+                ascii = True
+            return self._sequence(pattern, state, ignorecase, ascii)
+        elif op in _REPEATS:
+            _min, _max, pattern = av
+            copies = min(_min, _max_copies)
+            for i in range(copies):
+                state = self._sequence(pattern, state, ignorecase, ascii)
+            if _max - copies > _max_copies:
+                # a long or unbounded repeat, matching any number of times
+                start = self.state()
+                self.eps[state].append(start)
+                self.eps[self._sequence(pattern, start, ignorecase, ascii)].append(start)
+                return start
+            end = self.state()
+            for i in range(_max - copies):
+                self.eps[state].append(end)
+                state = self._sequence(pattern, state, ignorecase, ascii)
+            self.eps[state].append(end)
+            return end
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            return self._sequence(av, state, ignorecase, ascii)
+        elif op in _ZERO_WIDTH:
+            # assertions only make a regex match less, so they're ignored
+            return state
+        raise _Unsupported()
+
+    def closure(self, states):
+        stack = list(states)
+        seen = set(stack)
+        while stack:
+            for state in self.eps[stack.pop()]:
+                if state not in seen:
+                    seen.add(state)
+                    stack.append(state)
+        return seen
+
+def _charset(op, av, ignorecase, ascii):
+    if op is sre_parse.LITERAL:
+        return _ANY if ignorecase else _CharSet((av,))
+    elif op is sre_parse.IN and not ignorecase and av and av[0][0] is not sre_parse.NEGATE:
+        chars = set()
+        categories = set()
+        for item_op, item_av in av:
+            if item_op is sre_parse.LITERAL:
+                chars.add(item_av)
+            elif item_op is sre_parse.RANGE and item_av[1] - item_av[0] <= _max_range:
+                chars.update(range(item_av[0], item_av[1] + 1))
+            elif item_op is sre_parse.CATEGORY and item_av in _CATEGORIES and not ascii:
+                categories.add(item_av)
+            else:
+                return _ANY
+        return _CharSet(chars, categories)
+    return _ANY
+
+
+class _Analysis:
+    # decides if two alternatives can never both match at the same offset, by
+    # walking every pair of paths through them one character at a time until
+    # they can't agree on a character. the rules are treated like regular
+    # expressions (ignoring predicates and the order of choices), which match
+    # at least everything the rules do, so when the walk finds no common
+    # prefix, the alternatives really are exclusive
+    def __init__(self):
+        self._nfas = {}
+
+    def exclusive(self, a, b):
+        a, b = _strip(a, b)
+        if not a or not b:
+            return False
+        if self._excluded_by_predicate(a, b) or self._excluded_by_predicate(b, a):
+            return True
+        return self._disjoint(_stack(a), _stack(b))
+
+    def _excluded_by_predicate(self, a, b):
+        # `word - "null"` never matches where `"null"` does
+        a = _expand_head(a, False)
+        if not a or not isinstance(a[0], Predicate) or not isinstance(a[0].predicate, Terminal):
+            return False
+        predicate = a[0].predicate
+        prefix = _literal(b)
+        if prefix is None or not predicate.terminal:
+            return False
+        skip, text = prefix
+        return text.startswith(predicate.terminal) and _same_position(predicate.ignore_whitespace, skip, text)
+
+    def _disjoint(self, a, b):
+        pairs = [(a, b)]
+        seen = {(a, b)}
+        for a, b in pairs:
+            if len(seen) > _max_pairs:
+                return False
+            a_accepts, a_edges = self._closure(a)
+            b_accepts, b_edges = self._closure(b)
+            if a_accepts or b_accepts:
+                return False
+            for a_chars, a_next in a_edges:
+                for b_chars, b_next in b_edges:
+                    if not a_chars.disjoint(b_chars):
+                        pair = (a_next, b_next)
+                        if pair not in seen:
+                            seen.add(pair)
+                            pairs.append(pair)
+        return True
+
+    def _closure(self, stack):
+        # the edges leaving a stack of rules still to match, and if it can end
+        # here. a stack is a linked list of (item, rest) pairs, where an item is
+        # either a rule, a repeat with the number of times it already matched,
+        # or a state of a regex
+        accepts = False
+        edges = []
+        todo = [stack]
+        seen = set(todo)
+        def push(stack):
+            if stack not in seen:
+                seen.add(stack)
+                todo.append(stack)
+        while todo and not accepts:
+            stack = todo.pop()
+            if stack is None or _depth(stack) > _max_stack:
+                accepts = True
+                break
+            item, rest = stack
+            if isinstance(item, tuple) and item[0] == "nfa":
+                nfa, state = item[1], item[2]
+                for state in nfa.closure((state,)):
+                    if state == nfa.final:
+                        push(rest)
+                    for chars, target in nfa.edges[state]:
+                        edges.append((chars, (("nfa", nfa, target), rest)))
+            elif isinstance(item, tuple):
+                repeat, count = item[1], item[2]
+                _min = repeat._min or 0
+                _max = repeat._max
+                if _max is not None and _max - _min > _max_copies:
+                    # treat long repeats as unbounded, which matches more
+                    _max = None
+                if count >= _min:
+                    push(rest)
+                if _max is None or count < _max:
+                    if count < _min or _max is not None:
+                        count += 1
+                    push((repeat.rule, (("repeat", repeat, count), rest)))
+            elif isinstance(item, Rule):
+                if item.rule is None:
+                    accepts = True
+                else:
+                    push((item.rule, rest))
+            elif isinstance(item, (Silent, Predicate)):
+                push((item.rule, rest))
+            elif isinstance(item, Lazy):
+                push((item.scanner, rest))
+            elif isinstance(item, Expression):
+                # only the first operand is modelled, anything may follow it
+                if item.prefix.operators:
+                    accepts = True
+                else:
+                    push((item.operand, None))
+            elif isinstance(item, Join):
+                for rule in reversed(item.rules):
+                    rest = (rule, rest)
+                push(rest)
+            elif isinstance(item, Choice):
+                for rule in item.rules:
+                    push((rule, rest))
+            elif isinstance(item, Repeat):
+                push((("repeat", item, 0), rest))
+            elif isinstance(item, (Terminal, Regex, EndOfStream, Balanced)):
+                nfa = self._nfa(item)
+                if nfa is None:
+                    accepts = True
+                else:
+                    push((("nfa", nfa, nfa.start), rest))
+            elif isinstance(item, Empty):
+                push(rest)
+            else:
+                # a rule this analysis doesn't understand could match anything
+                accepts = True
+        return accepts, edges
+
+    def _nfa(self, rule):
+        key = id(rule)
+        if key in self._nfas:
+            return self._nfas[key][1]
+        nfa = None
+        try:
+            if isinstance(rule, Terminal):
+                items = [(sre_parse.LITERAL, ord(char)) for char in rule.terminal]
+                nfa = _NFA().build(items, rule.ignore_whitespace, False, False)
+            elif isinstance(rule, Balanced):
+                # anything between the delimiters
+                items = [(sre_parse.LITERAL, ord(char)) for char in rule.open]
+                items.append((sre_parse.MAX_REPEAT, (0, sre_parse.MAXREPEAT, [(sre_parse.ANY, None)])))
+                items.extend((sre_parse.LITERAL, ord(char)) for char in rule.close)
+                nfa = _NFA().build(items, rule.ignore_whitespace, False, False)
+            elif isinstance(rule, Regex):
+                expression = rule.expression
+                if isinstance(expression.pattern, str):
+                    items = sre_parse.parse(expression.pattern, expression.flags)
+                    nfa = _NFA().build(items, rule.ignore_whitespace,
+                        bool(expression.flags & re.IGNORECASE), bool(expression.flags & (re.ASCII | re.LOCALE)))
+            else:
+                # the end of the stream only skips whitespace
+                nfa = _NFA().build((), rule.ignore_whitespace, False, False)
+        except (_Unsupported, re.error, RecursionError):
+            nfa = None
+        # keep the rule alive, so its id isn't reused while cached
+        self._nfas[key] = (rule, nfa)
+        return nfa
+
+def _depth(stack):
+    depth = 0
+    while stack is not None:
+        stack = stack[1]
+        depth += 1
+    return depth
+
+def _stack(rules):
+    stack = None
+    for rule in reversed(rules):
+        stack = (rule, stack)
+    return stack
+
+def _expand_head(rules, predicates):
+    # replace the first rule until it's something other than a wrapper or a
+    # sequence, since those match exactly like their contents
+    rules = list(rules)
+    for i in range(_max_stack):
+        if not rules:
+            break
+        head = rules[0]
+        if isinstance(head, (Rule, Silent)) and head.rule is not None:
+            rules[0:1] = [head.rule]
+        elif isinstance(head, Join):
+            rules[0:1] = head.rules
+        elif isinstance(head, Lazy):
+            # a lazy rule matches exactly what its scanner does
+            rules[0:1] = [head.scanner]
+        elif predicates and isinstance(head, Predicate):
+            rules[0:1] = [head.rule]
+        else:
+            break
+    return rules
+
+def _strip(a, b):
+    # the same rule object matches the same way in both alternatives, so a
+    # common leading rule (like the comment rule) can't tell them apart
+    a, b = [a], [b]
+    for i in range(_max_pairs):
+        if not a or not b:
+            break
+        if a[0] is not b[0]:
+            a, b = _expand_head(a, False), _expand_head(b, False)
+            if not a or not b or a[0] is not b[0]:
+                break
+        del a[0], b[0]
+    return a, b
+
+def _literal(rules):
+    # the text every match of a sequence starts with, and if whitespace is
+    # skipped before it
+    rules = _expand_head(rules, True)
+    if rules and isinstance(rules[0], Balanced):
+        return rules[0].ignore_whitespace, rules[0].open
+    if not rules or not isinstance(rules[0], Terminal) or not rules[0].terminal:
+        return None
+    return rules[0].ignore_whitespace, rules[0].terminal
+
+def _same_position(a_skips, b_skips, b_text):
+    # both start matching at the same offset if they skip whitespace the same
+    # way, or if `a` skips it but `b` can only match where there isn't any
+    return a_skips == b_skips or (a_skips and not b_text[0].isspace())
+
+
+class _ChoiceStats:
+    def __init__(self, profile, choice, key, alternatives, exclusive):
+        self.profile = profile
+        self.choice = choice
+        self.key = key
+        self.alternatives = alternatives
+        # index pairs (i, j) with i < j of alternatives that can be swapped
+        self.exclusive = exclusive
+        self.rules = alternatives
+        self.order = tuple(range(len(self.rules)))
+        self.counts = dict.fromkeys(self.rules, 0)
+        self.recorded = 0
+
+    def record(self, rule):
+        profile = self.profile
+        if not profile.learn:
+            return
+        self.counts[rule] += 1
+        self.recorded += 1
+        if self.recorded % profile.interval == 0:
+            self.reorder()
+
+    def statistics(self):
+        return [self.counts[rule] for rule in self.alternatives]
+
+    def reorder(self):
+        # bubble the alternatives that match most often to the front, only
+        # ever swapping neighbours that can't both match, so the first
+        # alternative to match is always the same one as in the original order.
+        # ties keep their current order, so a loaded order isn't undone
+        counts = self.statistics()
+        order = list(self.order)
+        changed = True
+        while changed:
+            changed = False
+            for k in range(len(order) - 1):
+                i, j = order[k], order[k + 1]
+                if counts[j] > counts[i] and (min(i, j), max(i, j)) in self.exclusive:
+                    order[k], order[k + 1] = j, i
+                    changed = True
+        self.apply(order)
+
+    def is_safe(self, order):
+        if sorted(order) != list(range(len(self.alternatives))):
+            return False
+        for k, i in enumerate(order):
+            for j in order[k + 1:]:
+                if i > j and (j, i) not in self.exclusive:
+                    return False
+        return True
+
+    def apply(self, order):
+        self.order = tuple(order)
+        # Choice.match reads `rules` once per call, so replacing it is safe
+        # while other threads are parsing
+        self.rules = tuple(self.alternatives[i] for i in order)
+
+
+def _alternatives(choice, seen):
+    # `a | b | c` builds nested choices, which match the same as a single
+    # choice of all three, so they're reordered as one
+    alternatives = []
+    stack = [choice]
+    while stack:
+        rule = stack.pop()
+        if isinstance(rule, Choice) and (rule is choice or id(rule) not in seen):
+            seen.add(id(rule))
+            stack.extend(reversed(rule.rules))
+        else:
+            alternatives.append(rule)
+    return tuple(alternatives)
+
+def _choices(rule):
+    # name every choice after the closest named rule containing it, and its
+    # position in that rule, so learned orders can be saved and loaded again
+    keys = {}
+    counts = {}
+    seen = set()
+    if isinstance(rule, Rule):
+        seen.add(id(rule))
+    queue = [rule]
+    for owner in queue:
+        if isinstance(owner, Rule):
+            name = owner.name
+            stack = [owner.rule]
+        else:
+            name = ""
+            stack = [owner]
+        while stack:
+            rule = stack.pop()
+            if rule is None or id(rule) in seen:
+                continue
+            seen.add(id(rule))
+            if isinstance(rule, Rule):
+                queue.append(rule)
+                continue
+            if isinstance(rule, Choice):
+                index = counts.get(name, 0)
+                counts[name] = index + 1
+                alternatives = _alternatives(rule, seen)
+                keys[rule] = ("{}:{}".format(name, index), alternatives)
+                stack.extend(reversed(alternatives))
+            else:
+                stack.extend(reversed(list(iter_rule(rule))))
+    return keys
+
+
+class ChoiceProfile:
+    def __init__(self, rule, orders=None, learn=True, interval=1024):
+        self.rule = RuleBuilder.unwrap(rule)
+        self.learn = learn
+        self.interval = interval
+        self.choices = {}
+        self._keys = {}
+        analysis = _Analysis()
+        for choice, (key, rules) in _choices(self.rule).items():
+            exclusive = set()
+            for i in range(len(rules)):
+                for j in range(i + 1, len(rules)):
+                    if analysis.exclusive(rules[i], rules[j]):
+                        exclusive.add((i, j))
+            # a choice that can't be reordered isn't worth tracking
+            if exclusive:
+                stats = _ChoiceStats(self, choice, key, rules, frozenset(exclusive))
+                self.choices[choice] = stats
+                self._keys[key] = stats
+        if orders is not None:
+            self.load(orders)
+
+    def get(self, choice):
+        return self.choices.get(choice)
+
+    def reorder(self):
+        for stats in self.choices.values():
+            stats.reorder()
+
+    def statistics(self):
+        return {key: stats.statistics() for key, stats in self._keys.items()}
+
+    def export(self):
+        return {key: list(stats.order) for key, stats in self._keys.items()}
+
+    def load(self, orders):
+        checked = []
+        for key, order in orders.items():
+            stats = self._keys.get(key)
+            if stats is None:
+                raise ValueError("no reorderable choice named `{}` in the grammar".format(key))
+            order = list(order)
+            if not stats.is_safe(order):
+                raise ValueError("order {} for choice `{}` could change the parse result".format(order, key))
+            checked.append((stats, order))
+        for stats, order in checked:
+            stats.apply(order)
@@ -0,0 +1,349 @@
+import re
+import sys
+from .rules import *
+from .rules import _scan_balanced
+from .util import sre_parse, _global_flags
+
+# atomic groups and possessive repeats give a regex the same (no backtracking)
+# semantics as the rules, but they were only added in python 3.11
+_can_compile = sys.version_info >= (3, 11)
+_max_pattern_size = 100000
+_backreference = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+_inline_flags = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"), (re.ASCII, "a"))
+
+
+class Recognizer:
+    def __init__(self, rule, explicit_new_lines=False):
+        # recognizers are cached in a WeakKeyDictionary keyed by the rule, so
+        # they must not keep a reference to it (or to any rule containing it)
+        self.explicit_new_lines = explicit_new_lines
+        self.complete = True
+        self._skip = r"[^\S\n]*+" if explicit_new_lines else r"\s*+"
+        self._whitespace = re.compile(r"[^\S\n]*" if explicit_new_lines else r"\s*")
+        self._patterns = {}
+        self._compiling = set()
+        self._nullable = {}
+        self._matchers = {}
+        self.pattern = self._compile(rule)
+        self._match = self._matcher(rule)
+
+    def recognize(self, source, offset=0):
+        offset = self._match(source, offset)
+        return None if offset < 0 else offset
+
+    # compiling rules into a single regex
+    def _pattern(self, rule):
+        key = id(rule)
+        if key in self._patterns:
+            return self._patterns[key]
+        if key in self._compiling or not _can_compile:
+            # recursive rules can't be expressed as a regex
+            return None
+        self._compiling.add(key)
+        try:
+            pattern = self._build_pattern(rule)
+        finally:
+            self._compiling.discard(key)
+        if pattern is not None and len(pattern) > _max_pattern_size:
+            pattern = None
+        self._patterns[key] = pattern
+        return pattern
+
+    def _build_pattern(self, rule):
+        skip = self._skip
+        if isinstance(rule, Rule):
+            if rule.rule is None:
+                return None
+            return self._pattern(rule.rule)
+        elif isinstance(rule, Join):
+            patterns = [self._pattern(r) for r in rule.rules]
+            if None in patterns:
+                return None
+            return "".join(patterns)
+        elif isinstance(rule, Choice):
+            patterns = [self._pattern(r) for r in rule.rules]
+            if None in patterns:
+                return None
+            return "(?>" + "|".join(patterns) + ")"
+        elif isinstance(rule, Repeat):
+            pattern = self._pattern(rule.rule)
+            # an empty repetition raises an error, which a regex can't
+            if pattern is None or self._is_nullable(rule.rule):
+                return None
+            _min = rule._min or 0
+            _max = "" if rule._max is None else rule._max
+            return "(?:{}){{{},{}}}+".format(pattern, _min, _max)
+        elif isinstance(rule, Predicate):
+            predicate = self._pattern(rule.predicate)
+            pattern = self._pattern(rule.rule)
+            if predicate is None or pattern is None:
+                return None
+            return "(?!" + predicate + ")" + pattern
+        elif isinstance(rule, Silent):
+            return self._pattern(rule.rule)
+        elif isinstance(rule, Lazy):
+            # parsing a lazy rule only runs its scanner
+            return self._pattern(rule.scanner)
+        elif isinstance(rule, Expression):
+            return self._expression_pattern(rule)
+        elif isinstance(rule, Terminal):
+            return (skip if rule.ignore_whitespace else "") + re.escape(rule.terminal)
+        elif isinstance(rule, Regex):
+            expression = rule.expression
+            if not isinstance(expression.pattern, str) or expression.groupindex or _backreference.search(expression.pattern):
+                return None
+            flags = "".join(letter for flag, letter in _inline_flags if expression.flags & flag)
+            # inline global flags are already part of expression.flags
+            pattern = _global_flags.sub("", expression.pattern)
+            if expression.flags & re.VERBOSE:
+                # a comment at the end of the pattern would hide the closing paren
+                pattern += "\n"
+            pattern = "(?>(?{}:{}))".format(flags, pattern) if flags else "(?>" + pattern + ")"
+            return (skip if rule.ignore_whitespace else "") + pattern
+        elif isinstance(rule, Empty):
+            return ""
+        elif isinstance(rule, EndOfStream):
+            return (skip if rule.ignore_whitespace else "") + r"\Z"
+        return None
+
+    def _expression_pattern(self, rule):
+        # the longest of several operator rules can't be picked by a regex
+        tables = (rule.prefix, rule.infix, rule.postfix)
+        if any(table.rules for table in tables):
+            return None
+        operand = self._pattern(rule.operand)
+        separator = "" if rule.separator is None else self._pattern(rule.separator)
+        if operand is None or separator is None:
+            return None
+        prefix, infix, postfix = [separator + self._skip + "(?>" + table.expression.pattern + ")"
+            if table.operators else None for table in tables]
+        unary = operand if prefix is None else "(?:{})*+{}".format(prefix, operand)
+        # an infix operator is only taken when an operand follows it, otherwise
+        # the same text may still be a postfix operator
+        tails = []
+        if infix is not None:
+            tails.append("(?>" + infix + unary + ")")
+        if postfix is not None:
+            tails.append(postfix)
+        if not tails:
+            return "(?>" + unary + ")"
+        return "(?>{}(?:{})*+)".format(unary, "|".join(tails))
+
+    def _compile(self, rule):
+        pattern = self._pattern(rule)
+        if pattern is None:
+            return None
+        try:
+            return re.compile(pattern)
+        except (re.error, RecursionError, OverflowError):
+            return None
+
+    def _is_nullable(self, rule):
+        # may the rule match without consuming anything, assume it can when unsure
+        key = id(rule)
+        if key in self._nullable:
+            return self._nullable[key]
+        self._nullable[key] = True
+        if isinstance(rule, Terminal):
+            nullable = not rule.terminal
+        elif isinstance(rule, Regex):
+            try:
+                nullable = sre_parse.parse(rule.expression.pattern, rule.expression.flags).getwidth()[0] == 0
+            except Exception:
+                nullable = True
+        elif isinstance(rule, Join):
+            nullable = all(self._is_nullable(r) for r in rule.rules)
+        elif isinstance(rule, Choice):
+            nullable = any(self._is_nullable(r) for r in rule.rules)
+        elif isinstance(rule, Repeat):
+            nullable = not rule._min or self._is_nullable(rule.rule)
+        elif isinstance(rule, (Rule, Silent, Predicate)):
+            nullable = rule.rule is None or self._is_nullable(rule.rule)
+        elif isinstance(rule, Lazy):
+            nullable = self._is_nullable(rule.scanner)
+        elif isinstance(rule, Balanced):
+            nullable = False
+        elif isinstance(rule, Expression):
+            nullable = self._is_nullable(rule.operand)
+        else:
+            nullable = True
+        self._nullable[key] = nullable
+        return nullable
+
+    # matching rules that can't be compiled, without building a tree
+    def _matcher(self, rule):
+        key = id(rule)
+        if key in self._matchers:
+            return self._matchers[key]
+        expression = self._compile(rule)
+        if expression is not None:
+            matcher = _regex_matcher(expression, False, None)
+        elif isinstance(rule, Rule):
+            # register the rule before its children, since they may refer to it
+            inner = []
+            def matcher(source, offset):
+                return inner[0](source, offset)
+            self._matchers[key] = matcher
+            if rule.rule is None:
+                self.complete = False
+                inner.append(_forward_declared(rule))
+            else:
+                inner.append(self._matcher(rule.rule))
+            return matcher
+        elif isinstance(rule, Join):
+            matcher = _join_matcher([self._matcher(r) for r in rule.rules])
+        elif isinstance(rule, Choice):
+            matcher = _choice_matcher([self._matcher(r) for r in rule.rules])
+        elif isinstance(rule, Repeat):
+            matcher = _repeat_matcher(self._matcher(rule.rule), rule._min, rule._max)
+        elif isinstance(rule, Predicate):
+            matcher = _predicate_matcher(self._matcher(rule.rule), self._matcher(rule.predicate))
+        elif isinstance(rule, Silent):
+            matcher = self._matcher(rule.rule)
+        elif isinstance(rule, Lazy):
+            matcher = self._matcher(rule.scanner)
+        elif isinstance(rule, Balanced):
+            matcher = _balanced_matcher(rule.open, rule.expression, rule.ignore_whitespace, self._whitespace)
+        elif isinstance(rule, Expression):
+            separator = None if rule.separator is None else self._matcher(rule.separator)
+            prefix, infix, postfix = [_operator_matcher(table, [self._matcher(r) for r, p, a in table.rules],
+                separator, self._whitespace) for table in (rule.prefix, rule.infix, rule.postfix)]
+            matcher = _expression_matcher(self._matcher(rule.operand), prefix, infix, postfix)
+        elif isinstance(rule, Terminal):
+            matcher = _terminal_matcher(rule.terminal, rule.ignore_whitespace, self._whitespace)
+        elif isinstance(rule, Regex):
+            matcher = _regex_matcher(rule.expression, rule.ignore_whitespace, self._whitespace)
+        elif isinstance(rule, Empty):
+            matcher = lambda source, offset: offset
+        elif isinstance(rule, EndOfStream):
+            matcher = _end_of_stream_matcher(rule.ignore_whitespace, self._whitespace)
+        else:
+            raise TypeError("rule should be an instance of BaseRule, not " + rule.__class__.__name__)
+        self._matchers[key] = matcher
+        return matcher
+
+def _forward_declared(rule):
+    def matcher(source, offset):
+        raise RuntimeError("rule `{}` was forward declared, but never given a value with assign_rule()".format(rule.name))
+    return matcher
+
+def _join_matcher(matchers):
+    def matcher(source, offset):
+        for match in matchers:
+            offset = match(source, offset)
+            if offset < 0:
+                return -1
+        return offset
+    return matcher
+
+def _choice_matcher(matchers):
+    def matcher(source, offset):
+        for match in matchers:
+            new_offset = match(source, offset)
+            if new_offset >= 0:
+                return new_offset
+        return -1
+    return matcher
+
+def _repeat_matcher(match, _min, _max):
+    def matcher(source, offset):
+        count = 0
+        while _max is None or count < _max:
+            new_offset = match(source, offset)
+            if new_offset < 0:
+                break
+            if new_offset == offset:
+                raise RuntimeError("infinite loop detected inside Repeat rule")
+            offset = new_offset
+            count += 1
+        if _min is not None and count < _min:
+            return -1
+        return offset
+    return matcher
+
+def _predicate_matcher(match, predicate):
+    def matcher(source, offset):
+        if predicate(source, offset) >= 0:
+            return -1
+        return match(source, offset)
+    return matcher
+
+def _terminal_matcher(terminal, ignore_whitespace, whitespace):
+    def matcher(source, offset):
+        if ignore_whitespace:
+            offset = whitespace.match(source, offset).end()
+        if source.startswith(terminal, offset):
+            return offset + len(terminal)
+        return -1
+    return matcher
+
+def _regex_matcher(expression, ignore_whitespace, whitespace):
+    def matcher(source, offset):
+        if ignore_whitespace:
+            offset = whitespace.match(source, offset).end()
+        result = expression.match(source, offset)
+        return -1 if result is None else result.end()
+    return matcher
+
+def _end_of_stream_matcher(ignore_whitespace, whitespace):
+    def matcher(source, offset):
+        if ignore_whitespace:
+            offset = whitespace.match(source, offset).end()
+        return offset if offset >= len(source) else -1
+    return matcher
+
+def _balanced_matcher(open, expression, ignore_whitespace, whitespace):
+    def matcher(source, offset):
+        if ignore_whitespace:
+            offset = whitespace.match(source, offset).end()
+        return _scan_balanced(source, offset, open, expression)
+    return matcher
+
+def _operator_matcher(table, rules, separator, whitespace):
+    expression = table.expression
+    if not table.operators:
+        return None
+    def matcher(source, offset):
+        if separator is not None:
+            offset = separator(source, offset)
+            if offset < 0:
+                return -1
+        offset = whitespace.match(source, offset).end()
+        end = -1
+        if expression is not None:
+            result = expression.match(source, offset)
+            if result:
+                end = result.end()
+        for match in rules:
+            new_end = match(source, offset)
+            if new_end > max(end, offset):
+                end = new_end
+        return end
+    return matcher
+
+def _expression_matcher(operand, prefix, infix, postfix):
+    def unary(source, offset):
+        if prefix is not None:
+            while True:
+                end = prefix(source, offset)
+                if end < 0:
+                    break
+                offset = end
+        return operand(source, offset)
+    def matcher(source, offset):
+        offset = unary(source, offset)
+        if offset < 0:
+            return -1
+        while True:
+            if infix is not None:
+                end = infix(source, offset)
+                if end >= 0:
+                    end = unary(source, end)
+                    if end >= 0:
+                        offset = end
+                        continue
+            end = -1 if postfix is None else postfix(source, offset)
+            if end < 0:
+                return offset
+            offset = end
+    return matcher
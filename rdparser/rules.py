@@ -1,42 +1,60 @@
 import re
-from .nodes import Node, Token
+import time
+from .nodes import Node, Token, LazyNode
+from .util import sre_parse, _global_flags
 
 __all__ = ('BaseRule', 'Rule', 'Join', 'Choice', 'Repeat', 'Option', 'Predicate', 'Terminal',
-    'Regex', 'Empty', 'Silent', 'EndOfStream', 'RuleError', 'TerminalError',
-    'RegexError', 'PredicateError', 'EndOfStreamError', 'use_explicit_new_lines')
+    'Regex', 'Empty', 'Silent', 'EndOfStream', 'Balanced', 'Lazy', 'Expression', 'RuleError', 'TerminalError',
+    'RegexError', 'PredicateError', 'EndOfStreamError', 'BalancedError', 'LimitError', 'ParseContext',
+    'ParseLimits', 'use_explicit_new_lines')
 
 class BaseRule:
     pass
 
 class Rule(BaseRule):
+    # counts every assign_rule() call, so cached recognizers can tell when a
+    # rule they were built from may have changed
+    assignments = 0
+
     def __init__(self, name="", rule=None, **opts):
         self.name = name
         self.rule = rule
         self.opts = opts
+        self.sealed = False
 
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         if self.rule is None:
             raise RuntimeError("rule `{}` was forward declared, but never given a value with assign_rule()".format(self.name))
+        budget = context.budget
+        if budget is not None:
+            budget.enter(self, offset)
         node = Node(offset, self.name, **self.opts)
         nodes.append(node)
-        offset, error = self.rule.match(source, offset, node.nodes)
+        try:
+            offset, error = self.rule.match(source, offset, node.nodes, context)
+        finally:
+            if budget is not None:
+                budget.rules.pop()
         node.end_offset = offset
         return offset, error
 
     def assign_rule(self, rule):
+        if self.sealed:
+            raise RuntimeError("rule `{}` belongs to a sealed grammar and can't be changed".format(self.name))
         self.rule = rule
+        Rule.assignments += 1
 
 class Join(BaseRule):
     def __init__(self, rules):
         self.rules = rules
 
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         furthest = None
         failed = False
         for rule in self.rules:
             try:
                 new_nodes = []
-                offset, error = rule.match(source, offset, new_nodes)
+                offset, error = rule.match(source, offset, new_nodes, context)
                 if error is not None and (furthest is None or error.offset >= furthest.offset):
                     furthest = error
             except RuleError as error:
@@ -52,16 +70,25 @@ class Choice(BaseRule):
     def __init__(self, rules):
         self.rules = rules
     
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         furthest = None
         furthest_nodes = None
         success = False
-        for rule in self.rules:
+        rules = self.rules
+        stats = None
+        if context.profile is not None:
+            # a ChoiceProfile may try the alternatives in a different order
+            stats = context.profile.get(self)
+            if stats is not None:
+                rules = stats.rules
+        for rule in rules:
             try:
                 new_nodes = []
-                offset, error = rule.match(source, offset, new_nodes)
+                offset, error = rule.match(source, offset, new_nodes, context)
                 furthest_nodes = new_nodes
                 success = True
+                if stats is not None:
+                    stats.record(rule)
                 if error is not None and (furthest is None or error.offset >= furthest.offset):
                     furthest = error
                 break
@@ -80,7 +107,7 @@ class Repeat(BaseRule):
         self._min = _min
         self._max = _max
     
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         last_error = None
         count = 0
         _max = self._max
@@ -88,7 +115,7 @@ class Repeat(BaseRule):
             try:
                 _offset = offset
                 new_nodes = []
-                offset, last_error = self.rule.match(source, offset, new_nodes)
+                offset, last_error = self.rule.match(source, offset, new_nodes, context)
                 nodes.extend(new_nodes)
                 if _offset == offset:
                     raise RuntimeError("infinite loop detected inside Repeat rule")
@@ -107,11 +134,11 @@ class Predicate(BaseRule):
         self.rule = rule
         self.predicate = predicate
     
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         try:
-            new_offset, error = self.predicate.match(source, offset, [])
+            new_offset, error = self.predicate.match(source, offset, [], context)
         except RuleError as e:
-            return self.rule.match(source, offset, nodes)
+            return self.rule.match(source, offset, nodes, context)
         else:
             raise PredicateError(offset, "predicate matched", self.predicate)
 
@@ -121,14 +148,19 @@ class Terminal(BaseRule):
         self.ignore_token = ignore_token
         self.ignore_whitespace = ignore_whitespace
     
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         _offset = offset
+        budget = context.budget
+        if budget is not None:
+            budget.step(self, offset)
         if self.ignore_whitespace:
-            offset = _skip_whitespace(source, offset)
+            offset = _skip_whitespace(source, offset, context)
         if source.startswith(self.terminal, offset):
             offset += len(self.terminal)
             node = Token(offset, self.terminal)
             if not self.ignore_token:
+                if budget is not None:
+                    budget.add_node(self, offset)
                 nodes.append(node)
             return offset, None
         else:
@@ -140,41 +172,292 @@ class Regex(BaseRule):
         self.ignore_token = ignore_token
         self.ignore_whitespace = ignore_whitespace
     
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         _offset = offset
+        budget = context.budget
+        if budget is not None:
+            budget.step(self, offset)
         if self.ignore_whitespace:
-            offset = _skip_whitespace(source, offset)
+            offset = _skip_whitespace(source, offset, context)
         result = self.expression.match(source, offset)
         if not result:
             raise RegexError(_offset, "regex failed to match", self)
         match = result[0]
         offset += len(match)
         if not self.ignore_token:
+            if budget is not None:
+                budget.add_node(self, offset)
             nodes.append(Token(offset, match))
         return offset, None
 
 class Empty(BaseRule):
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         return offset, None
 
 class Silent(BaseRule):
     def __init__(self, rule):
         self.rule = rule
     
-    def match(self, source, offset, nodes):
-        offset, error = self.rule.match(source, offset, [])
+    def match(self, source, offset, nodes, context):
+        offset, error = self.rule.match(source, offset, [], context)
         return offset, None
 
 class EndOfStream(BaseRule):
     def __init__(self, ignore_whitespace=True):
         self.ignore_whitespace = ignore_whitespace
-    def match(self, source, offset, nodes):
+    def match(self, source, offset, nodes, context):
         if self.ignore_whitespace:
-            offset = _skip_whitespace(source, offset)
+            offset = _skip_whitespace(source, offset, context)
         if offset < len(source):
             raise EndOfStreamError(offset, "expected end of stream", self)
         return offset, None
 
+class Balanced(BaseRule):
+    def __init__(self, open, close, ignore=None, ignore_token=False, ignore_whitespace=True):
+        if not open or not close or open == close:
+            raise ValueError("open and close must be different, non-empty strings")
+        self.open = open
+        self.close = close
+        self.ignore = ignore
+        self.ignore_token = ignore_token
+        self.ignore_whitespace = ignore_whitespace
+        delimiters = "(?P<_open>{})|(?P<_close>{})".format(re.escape(open), re.escape(close))
+        if ignore is None:
+            self.expression = re.compile(delimiters)
+        else:
+            if sre_parse.parse(ignore.pattern, ignore.flags).getwidth()[0] == 0:
+                # an empty match would hide the delimiter at the same offset
+                raise ValueError("ignore regex `{}` can match empty text".format(ignore.pattern))
+            # regions matched by `ignore` (like strings or comments) are skipped
+            # over, so delimiters inside them aren't counted
+            pattern = _global_flags.sub("", ignore.pattern)
+            self.expression = re.compile("(?:{})|{}".format(pattern, delimiters), ignore.flags)
+
+    def scan(self, source, offset):
+        # the offset after the close matching the open at `offset`, or -1
+        return _scan_balanced(source, offset, self.open, self.expression)
+
+    def match(self, source, offset, nodes, context):
+        _offset = offset
+        budget = context.budget
+        if budget is not None:
+            budget.step(self, offset)
+        if self.ignore_whitespace:
+            offset = _skip_whitespace(source, offset, context)
+        end = self.scan(source, offset)
+        if end < 0:
+            raise BalancedError(_offset, "failed to match balanced `{}` and `{}`".format(self.open, self.close), self)
+        if not self.ignore_token:
+            if budget is not None:
+                budget.add_node(self, end)
+            nodes.append(Token(end, source[offset:end]))
+        return end, None
+
+def _scan_balanced(source, offset, open, expression):
+    if not source.startswith(open, offset):
+        return -1
+    depth = 0
+    search = expression.search
+    while offset <= len(source):
+        result = search(source, offset)
+        if result is None:
+            return -1
+        group = result.lastgroup
+        if group == "_open":
+            depth += 1
+        elif group == "_close":
+            depth -= 1
+            if depth == 0:
+                return result.end()
+        offset = max(result.end(), offset + 1)
+    return -1
+
+class Lazy(BaseRule):
+    # only runs the cheap `scanner` rule while parsing, and creates a LazyNode
+    # which parses the scanned region with `rule` when it's first used
+    def __init__(self, rule, scanner, name="", **opts):
+        self.rule = rule
+        self.scanner = scanner
+        self.name = name
+        self.opts = opts
+
+    def match(self, source, offset, nodes, context):
+        budget = context.budget
+        if budget is not None:
+            budget.step(self, offset)
+            budget.add_node(self, offset)
+        end, error = self.scanner.match(source, offset, [], context)
+        settings = (context.explicit_new_lines, context.profile, context.limits, end)
+        node = LazyNode(offset, self.name, self, source, settings, **self.opts)
+        node.end_offset = end
+        nodes.append(node)
+        return end, None
+
+    def load(self, source, offset, settings, nodes):
+        # parse the scanned region into nodes, raising a RuleError or LimitError
+        # like match does. LazyNode turns those into a ParseError
+        explicit_new_lines, profile, limits, end = settings
+        context = ParseContext(explicit_new_lines, profile, limits)
+        new_offset, error = self.rule.match(source, offset, nodes, context)
+        if new_offset != end:
+            raise RuleError(new_offset, "lazy rule ended at {}, but its region ends at {}".format(new_offset, end), self)
+
+class Expression(BaseRule):
+    # operands joined by infix, prefix and postfix operators, parsed with
+    # precedence climbing in a single loop instead of one rule per level of
+    # precedence. each operator table is a sequence of (operator, precedence,
+    # right_associative), where an operator is a string or a rule
+    def __init__(self, operand, infix=(), prefix=(), postfix=(), separator=None):
+        self.operand = operand
+        self.infix = _OperatorTable(infix)
+        self.prefix = _OperatorTable(prefix)
+        self.postfix = _OperatorTable(postfix)
+        self.separator = separator
+
+    def match(self, source, offset, nodes, context):
+        budget = context.budget
+        # operands are (start, end, nodes), and operators waiting for their
+        # operands are (precedence, name, token, start)
+        operands = []
+        operators = []
+        offset, prefixes, operand, error = self._unary(source, offset, context)
+        operators.extend(prefixes)
+        operands.append(operand)
+        while True:
+            if budget is not None:
+                budget.step(self, offset)
+            found = self._operator(self.infix, source, offset, context)
+            if found is not None:
+                end, token, precedence, right = found
+                try:
+                    new_offset, prefixes, operand, new_error = self._unary(source, end, context)
+                except RuleError as e:
+                    # stop before the operator, it may belong to the rule that follows
+                    if error is None or e.offset >= error.offset:
+                        error = e
+                else:
+                    self._reduce(operands, operators, precedence, right, budget)
+                    operators.append((precedence, "binary", token, None))
+                    operators.extend(prefixes)
+                    operands.append(operand)
+                    offset = new_offset
+                    if new_error is not None and (error is None or new_error.offset >= error.offset):
+                        error = new_error
+                    continue
+            found = self._operator(self.postfix, source, offset, context)
+            if found is None:
+                break
+            end, token, precedence, right = found
+            self._reduce(operands, operators, precedence, False, budget)
+            start = operands[-1][0]
+            node = self._node(budget, start, end, "postfix", self._wrap("operand", operands[-1]), token)
+            operands[-1] = (start, end, [node])
+            offset = end
+        self._reduce(operands, operators, None, False, budget)
+        nodes.extend(operands[0][2])
+        return offset, error
+
+    def _unary(self, source, offset, context):
+        # the prefix operators and operand starting at offset, returned instead
+        # of pushed so a failed operand leaves the stacks unchanged
+        prefixes = []
+        while True:
+            found = self._operator(self.prefix, source, offset, context)
+            if found is None:
+                break
+            end, token, precedence, right = found
+            prefixes.append((precedence, "prefix", token, offset))
+            offset = end
+        operand_nodes = []
+        end, error = self.operand.match(source, offset, operand_nodes, context)
+        return end, prefixes, (offset, end, operand_nodes), error
+
+    def _operator(self, table, source, offset, context):
+        if not table.operators:
+            return None
+        if self.separator is not None:
+            try:
+                offset, error = self.separator.match(source, offset, [], context)
+            except RuleError:
+                return None
+        found = table.match(source, offset, context)
+        if found is None:
+            return None
+        end, text, precedence, right = found
+        return end, Token(end, text), precedence, right
+
+    def _reduce(self, operands, operators, precedence, right, budget):
+        # apply the waiting operators that bind tighter than the next operator,
+        # or all of them when precedence is None
+        while operators:
+            top = operators[-1]
+            if precedence is not None and (top[0] < precedence or (top[0] == precedence and right)):
+                break
+            operators.pop()
+            name, token, start = top[1:]
+            operand = operands.pop()
+            if name == "binary":
+                left = operands.pop()
+                node = self._node(budget, left[0], operand[1], name,
+                    self._wrap("left", left), token, self._wrap("right", operand))
+                operands.append((left[0], operand[1], [node]))
+            else:
+                node = self._node(budget, start, operand[1], name, token, self._wrap("operand", operand))
+                operands.append((start, operand[1], [node]))
+
+    def _wrap(self, name, operand):
+        # like `rule["name"]`, so the operand's mask is reached through the name
+        start, end, nodes = operand
+        node = Node(start, name, flatten=True)
+        node.nodes = nodes
+        node.end_offset = end
+        return node
+
+    def _node(self, budget, start, end, name, *children):
+        if budget is not None:
+            for child in children:
+                budget.add_node(self, end)
+            budget.add_node(self, end)
+        node = Node(start, name)
+        node.nodes = list(children)
+        node.end_offset = end
+        return node
+
+class _OperatorTable:
+    def __init__(self, operators):
+        self.operators = tuple(operators)
+        self.strings = {}
+        self.rules = []
+        for operator, precedence, right in self.operators:
+            if isinstance(operator, str):
+                if not operator:
+                    raise ValueError("an operator can't be an empty string")
+                self.strings[operator] = (precedence, right)
+            else:
+                self.rules.append((operator, precedence, right))
+        # the longest operator is tried first, so `**` isn't matched as `*`
+        strings = sorted(self.strings, key=len, reverse=True)
+        self.expression = re.compile("|".join(map(re.escape, strings))) if strings else None
+
+    def match(self, source, offset, context):
+        # the (end, text, precedence, right_associative) of the longest
+        # operator at offset, or None
+        offset = _skip_whitespace(source, offset, context)
+        found = None
+        if self.expression is not None:
+            result = self.expression.match(source, offset)
+            if result:
+                text = result[0]
+                found = (result.end(), text) + self.strings[text]
+        for rule, precedence, right in self.rules:
+            try:
+                end, error = rule.match(source, offset, [], context)
+            except RuleError:
+                continue
+            if end > (offset if found is None else found[0]):
+                found = (end, source[offset:end], precedence, right)
+        return found
+
 # matching rule errors
 class RuleError(Exception):
     def __init__(self, offset, reason, offending_rule):
@@ -194,11 +477,25 @@ class PredicateError(RuleError):
 class EndOfStreamError(RuleError):
     pass
 
+class BalancedError(RuleError):
+    pass
+
+# raised when a parse goes over one of its ParseLimits. it isn't a RuleError,
+# so rules don't mistake it for a failed match and backtrack
+class LimitError(Exception):
+    def __init__(self, offset, reason, offending_rule, limit, rules):
+        self.offset = offset
+        self.reason = reason
+        self.offending_rule = offending_rule
+        self.limit = limit
+        self.rules = rules
+
 
 # helpers and extensions
 def Option(rule):
     return Repeat(rule, 0, 1)
 
+# the default for parse contexts created without an explicit_new_lines flag
 explicit_new_lines = False
 
 def use_explicit_new_lines(b=None):
@@ -210,21 +507,78 @@ def use_explicit_new_lines(b=None):
 _match_all_whitespace = re.compile(r"\s*")
 _match_whitespace_no_new_lines = re.compile(r"[^\S\n]*")
 
-def _skip_whitespace(source, offset):
-    if not explicit_new_lines:
-        expression = _match_all_whitespace
-    else:
-        expression = _match_whitespace_no_new_lines
-    result = expression.match(source, offset)
-    if not result:
-        return offset
-    else:
-        return offset + len(result[0])
+class ParseLimits:
+    def __init__(self, max_steps=None, timeout=None, max_depth=None, max_nodes=None):
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+
+# the clock is only read every so many steps, since it's slower than a step
+_clock_interval = 256
+
+class _Budget:
+    def __init__(self, limits):
+        self.max_steps = limits.max_steps
+        self.max_depth = limits.max_depth
+        self.max_nodes = limits.max_nodes
+        self.deadline = None if limits.timeout is None else time.monotonic() + limits.timeout
+        self.timeout = limits.timeout
+        self.steps = 0
+        self.nodes = 0
+        # the named rules being matched, innermost last
+        self.rules = []
+
+    def enter(self, rule, offset):
+        self.step(rule, offset)
+        self.rules.append(rule)
+        if self.max_depth is not None and len(self.rules) > self.max_depth:
+            self.exceeded("max_depth", self.max_depth, rule, offset)
+        self.add_node(rule, offset)
+
+    def step(self, rule, offset):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exceeded("max_steps", self.max_steps, rule, offset)
+        if self.deadline is not None and self.steps % _clock_interval == 0 and time.monotonic() > self.deadline:
+            self.exceeded("timeout", self.timeout, rule, offset)
+
+    def add_node(self, rule, offset):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            self.exceeded("max_nodes", self.max_nodes, rule, offset)
+
+    def exceeded(self, limit, value, rule, offset):
+        # blame the innermost named rule, since the rule that went over the
+        # limit is usually just a terminal
+        if self.rules:
+            rule = self.rules[-1]
+        names = [r.name for r in self.rules]
+        name = " in rule `{}`".format(rule.name) if isinstance(rule, Rule) else ""
+        reason = "parse exceeded {}={}{}".format(limit, value, name)
+        raise LimitError(offset, reason, rule, limit, names)
+
+# all the state of a single parse, passed through every call to match, so
+# rules and grammars can be shared between threads parsing at the same time
+class ParseContext:
+    def __init__(self, explicit_new_lines=None, profile=None, limits=None):
+        if explicit_new_lines is None:
+            explicit_new_lines = use_explicit_new_lines()
+        self.explicit_new_lines = explicit_new_lines
+        self.profile = profile
+        self.limits = limits
+        self.budget = None if limits is None else _Budget(limits)
+        if explicit_new_lines:
+            self.whitespace = _match_whitespace_no_new_lines
+        else:
+            self.whitespace = _match_all_whitespace
 
+def _skip_whitespace(source, offset, context):
+    return context.whitespace.match(source, offset).end()
 
 SINGLE_RULES = (Rule, Repeat, Silent)
 MULTI_RULES = (Join, Choice)
-TERMINALS = (Terminal, Regex, Empty, EndOfStream)
+TERMINALS = (Terminal, Regex, Empty, EndOfStream, Balanced)
 
 def iter_rule(rule):
     if isinstance(rule, SINGLE_RULES):
@@ -235,6 +589,15 @@ def iter_rule(rule):
         yield from ()
     elif isinstance(rule, Predicate):
         yield from (rule.rule, rule.predicate)
+    elif isinstance(rule, Lazy):
+        yield from (rule.rule, rule.scanner)
+    elif isinstance(rule, Expression):
+        yield rule.operand
+        if rule.separator is not None:
+            yield rule.separator
+        for table in (rule.prefix, rule.infix, rule.postfix):
+            for operator, precedence, right in table.rules:
+                yield operator
     else:
         raise TypeError("rule should be an instance of BaseRule, not " + rule.__class__)
 
@@ -0,0 +1,265 @@
+import io
+import json
+import mmap
+import struct
+import sys
+from array import array
+from .nodes import Node, Token, NodeMask
+
+_string = json.encoder.encode_basestring_ascii
+_flush_size = 4096
+
+def _target(node):
+    if isinstance(node, NodeMask):
+        return node._inspector.target
+    return node
+
+def _iter_json(root, indent):
+    if isinstance(indent, int):
+        indent = " " * indent
+    if indent is None:
+        newline = lambda level: ""
+        comma = ", "
+    else:
+        newline = lambda level: "\n" + indent * level
+        comma = ","
+    # the stack holds either nodes (with their indent level) or literal text,
+    # so deep trees don't use python recursion
+    stack = [(root, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        node, level = item
+        inner = newline(level + 1)
+        if isinstance(node, Token):
+            yield "".join(("{", inner, '"offset": ', str(node.offset), comma, inner,
+                '"value": ', _string(node.value), newline(level), "}"))
+            continue
+        name = "null" if node.name is None else _string(node.name)
+        head = "".join(("{", inner, '"name": ', name, comma, inner, '"nodes": ['))
+        if not node.nodes:
+            yield head + "]" + newline(level) + "}"
+            continue
+        yield head
+        stack.append(inner + "]" + newline(level) + "}")
+        item_inner = newline(level + 2)
+        children = node.nodes
+        for i in range(len(children) - 1, 0, -1):
+            stack.append((children[i], level + 2))
+            stack.append(comma + item_inner)
+        stack.append((children[0], level + 2))
+        stack.append(item_inner)
+
+def _write_all(parts, fp):
+    buffer = []
+    for part in parts:
+        buffer.append(part)
+        if len(buffer) >= _flush_size:
+            fp.write("".join(buffer))
+            buffer.clear()
+    fp.write("".join(buffer))
+
+def dump_json(node, fp, indent=None):
+    _write_all(_iter_json(_target(node), indent), fp)
+
+def dumps_json(node, indent=None):
+    fp = io.StringIO()
+    dump_json(node, fp, indent)
+    return fp.getvalue()
+
+def dump_json_lines(nodes, fp):
+    for node in nodes:
+        _write_all(_iter_json(_target(node), None), fp)
+        fp.write("\n")
+
+
+# binary format, all sections aligned to 8 bytes:
+#   header
+#   name table, a utf-8 json list of [name, opts] pairs
+#   name column (int32, index into the name table, -1 for tokens)
+#   offset column (int64)
+#   end offset column (int64, -1 for tokens or missing end offsets)
+#   size column (uint32, number of nodes in the subtree, in pre-order)
+#   value offset column (uint64, count + 1 entries, token i's value is the
+#       bytes between entry i and i + 1 in the value section)
+#   value section (utf-8 token values)
+_MAGIC = b"RDPT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBcxxIIQ")
+_BYTEORDER = b"<" if sys.byteorder == "little" else b">"
+
+def _padding(size):
+    return -size % 8
+
+def dump_binary(node, fp):
+    root = _target(node)
+    kinds = array("i")
+    offsets = array("q")
+    ends = array("q")
+    sizes = array("I")
+    value_offsets = array("Q", [0])
+    values = []
+    names = {}
+    value_size = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, int):
+            # end of a subtree started at index `node`
+            sizes[node] = len(offsets) - node
+            continue
+        index = len(offsets)
+        offsets.append(node.offset)
+        if isinstance(node, Token):
+            value = node.value.encode("utf-8")
+            values.append(value)
+            value_size += len(value)
+            kinds.append(-1)
+            ends.append(-1)
+            sizes.append(1)
+        else:
+            key = (node.name, tuple(sorted(node.opts.items())))
+            kinds.append(names.setdefault(key, len(names)))
+            ends.append(-1 if node.end_offset is None else node.end_offset)
+            sizes.append(0)
+            stack.append(index)
+            stack.extend(reversed(node.nodes))
+        value_offsets.append(value_size)
+    table = json.dumps([[name, dict(opts)] for name, opts in names]).encode("utf-8")
+    fp.write(_HEADER.pack(_MAGIC, _VERSION, _BYTEORDER, len(offsets), len(table), value_size))
+    for section in (table, kinds, offsets, ends, sizes, value_offsets):
+        data = section if isinstance(section, bytes) else section.tobytes()
+        fp.write(data)
+        fp.write(b"\0" * _padding(len(data)))
+    for value in values:
+        fp.write(value)
+
+def dumps_binary(node):
+    fp = io.BytesIO()
+    dump_binary(node, fp)
+    return fp.getvalue()
+
+def load_binary(fp):
+    try:
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        buffer = fp.read()
+    return BinaryTree(buffer)
+
+
+class BinaryTree:
+    def __init__(self, buffer):
+        view = memoryview(buffer).cast("B")
+        if len(view) < _HEADER.size:
+            raise ValueError("buffer is too small to contain a binary parse tree")
+        magic, version, byteorder, count, table_size, value_size = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError("buffer doesn't contain a binary parse tree")
+        if version != _VERSION:
+            raise ValueError("unsupported binary parse tree version {}".format(version))
+        self._view = view
+        self._swap = byteorder != _BYTEORDER
+        self._position = _HEADER.size
+        table = json.loads(bytes(self._section(table_size)).decode("utf-8"))
+        self.names = [(name, opts) for name, opts in table]
+        self.kinds = self._column("i", count)
+        self.offsets = self._column("q", count)
+        self.ends = self._column("q", count)
+        self.sizes = self._column("I", count)
+        self.value_offsets = self._column("Q", count + 1)
+        self.values = self._section(value_size)
+
+    def _section(self, size):
+        start = self._position
+        self._position += size + _padding(size)
+        return self._view[start:start + size]
+
+    def _column(self, code, count):
+        section = self._section(count * array(code).itemsize)
+        if not self._swap:
+            return section.cast(code)
+        column = array(code)
+        column.frombytes(section)
+        column.byteswap()
+        return column
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def root(self):
+        return BinaryNode(self, 0)
+
+    def node(self, index):
+        return BinaryNode(self, index)
+
+    def value(self, index):
+        start, end = self.value_offsets[index], self.value_offsets[index + 1]
+        return str(self.values[start:end], "utf-8")
+
+
+class BinaryNode:
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def is_token(self):
+        return self.tree.kinds[self.index] < 0
+
+    @property
+    def name(self):
+        kind = self.tree.kinds[self.index]
+        return None if kind < 0 else self.tree.names[kind][0]
+
+    @property
+    def opts(self):
+        kind = self.tree.kinds[self.index]
+        return {} if kind < 0 else self.tree.names[kind][1]
+
+    @property
+    def offset(self):
+        return self.tree.offsets[self.index]
+
+    @property
+    def end_offset(self):
+        end = self.tree.ends[self.index]
+        return None if end < 0 else end
+
+    @property
+    def value(self):
+        return self.tree.value(self.index) if self.is_token else None
+
+    @property
+    def nodes(self):
+        return list(self)
+
+    def __iter__(self):
+        sizes = self.tree.sizes
+        index = self.index + 1
+        end = self.index + sizes[self.index]
+        while index < end:
+            yield BinaryNode(self.tree, index)
+            index += sizes[index]
+
+    def to_node(self):
+        tree = self.tree
+        root = []
+        stack = [(self.index, root)]
+        while stack:
+            index, nodes = stack.pop()
+            kind = tree.kinds[index]
+            if kind < 0:
+                nodes.append(Token(tree.offsets[index], tree.value(index)))
+                continue
+            name, opts = tree.names[kind]
+            node = Node(tree.offsets[index], name, **opts)
+            node.end_offset = tree.ends[index] if tree.ends[index] >= 0 else None
+            nodes.append(node)
+            children = [(child.index, node.nodes) for child in BinaryNode(tree, index)]
+            stack.extend(reversed(children))
+        return root[0]
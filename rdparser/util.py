@@ -1,3 +1,5 @@
+import re
+
 def pos_to_line_col(source, pos):
     offset = 0
     line = 0
@@ -7,3 +9,27 @@ def pos_to_line_col(source, pos):
         offset += len(line) + 1
         if offset > pos:
             return line, pos - _offset + 1
+
+# the regex parser moved in python 3.11, and the old module is deprecated
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# inline global flags at the start of a pattern, which have to be removed
+# before the pattern is embedded in a larger one
+_global_flags = re.compile(r"^\(\?[aiLmsux]+\)")
+
+_REPEATS = tuple(getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_parse, name))
+# opcodes that don't consume any characters
+_ZERO_WIDTH = tuple(getattr(sre_parse, name) for name in ("AT", "ASSERT", "ASSERT_NOT"))
+# the character classes behind \d, \s, \w and their negations
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_parse.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_parse.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_parse.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_parse.CATEGORY_WORD: re.compile(r"\w"),
+    sre_parse.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
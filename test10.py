@@ -0,0 +1,92 @@
+import itertools
+from rdparser import grammar
+from rdparser.builder import ParseError
+from rdparser.generator import CorpusGenerator
+from rdparser.profile import ChoiceProfile
+from rdparser.serialize import dumps_json
+
+def same_result(rule, source, profile):
+    try:
+        expected = rule.parse(source)
+    except ParseError:
+        expected = None
+    try:
+        result = rule.parse(source, profile=profile)
+    except ParseError:
+        result = None
+    if expected is None or result is None:
+        assert(expected is result)
+    else:
+        assert(expected[0] == result[0])
+        assert(dumps_json(expected[1]) == dumps_json(result[1]))
+
+# phone numbers never look like emails, so they can be tried first
+c, b = grammar()
+c.email = {r"[a-zA-Z0-9_.]+@[a-zA-Z0-9_.]+"}
+c.phone = {r"\d{3}-\d{3}-\d{4}"}
+c.contact_info = "contact_info(" + (c.email | c.phone) + ")"
+c.contacts = c.contact_info[1:] + b.EOS
+
+profile = ChoiceProfile(c.contacts, interval=16)
+assert(profile.export() == {"contact_info:0": [0, 1]})
+source = "contact_info(800-555-1234) " * 40 + "contact_info(a@b)"
+same_result(c.contacts, source, profile)
+assert(profile.statistics() == {"contact_info:0": [1, 40]})
+assert(profile.export() == {"contact_info:0": [1, 0]})
+same_result(c.contacts, source, profile)
+
+# a learned order can be loaded into a new profile, which stops learning
+profile = ChoiceProfile(c.contacts, profile.export(), learn=False)
+assert(profile.export() == {"contact_info:0": [1, 0]})
+c.contacts.parse("contact_info(a@b)" * 100, profile=profile)
+profile.reorder()
+assert(profile.export() == {"contact_info:0": [1, 0]})
+assert(len(c.contacts.parse_many([source] * 4, profile=profile)) == 4)
+
+# a number can also be a word, so their order is kept
+c, b = grammar()
+c.number = {r"-?(0|[1-9][0-9]*)(\.[0-9]+)?"}
+c.word = b({r"\w+"}) - "null"
+c.null = b * "null"
+c.value = c.number | c.null | c.word | c.list
+c.list = b("[") + [c.value + ("," + c.value)[:]] + "]"
+c.document = c.value[1:] + b.EOS
+
+profile = ChoiceProfile(c.document)
+assert(profile.export() == {"value:0": [0, 1, 2, 3]})
+for order in ([2, 0, 1, 3], [0, 1, 2]):
+    try:
+        profile.load({"value:0": order})
+        assert(False)
+    except ValueError:
+        pass
+try:
+    profile.load({"value:1": [0]})
+    assert(False)
+except ValueError:
+    pass
+
+# every order the profile accepts parses the same as the original order
+safe = [order for order in itertools.permutations(range(4)) if profile.choices[c.value.rule.rule].is_safe(order)]
+assert(len(safe) > 1)
+for seed, order in enumerate(safe):
+    profile.load({"value:0": order})
+    source = CorpusGenerator(c.document, seed=seed, max_depth=6).generate_string(300)
+    for end in range(0, len(source), 11):
+        same_result(c.document, source[:end], profile)
+
+# nested rules with a comment rule between them
+c, b = grammar(comment_rule={r"#[^\n]*"})
+c.name = {r"[a-z]+"}
+c.struct = b * "struct" + c.name + "{" + c.name[:] + "}"
+c.enum = b * "enum" + c.name + "{" + c.name[:] + "}"
+c.string = b * "string" + c.name
+c.item = c.struct | c.enum | c.string
+c.document = c.item[:] + b.EOS
+
+profile = ChoiceProfile(c.document)
+source = "enum a { b } # x\n string q\n" * 20 + "struct s { a b }"
+same_result(c.document, source, profile)
+profile.reorder()
+assert(profile.export() == {"item:0": [1, 2, 0]})
+same_result(c.document, source, profile)
@@ -0,0 +1,61 @@
+import time
+from rdparser import grammar, ParseError, ParseLimitError
+from rdparser.rules import ParseLimits
+
+# every level parses the term twice before failing, so unbalanced
+# parentheses take exponential time
+c, b = grammar()
+c.term = "(" + c.expression + ")" | b * "x"
+c.expression = c.term + "+" + c.expression | c.term
+c.document = c.expression + b.EOS
+
+source = "(" * 40 + "x"
+try:
+    c.document.parse(source, limits=ParseLimits(max_steps=10000))
+    assert(False)
+except ParseLimitError as e:
+    assert(isinstance(e, ParseError))
+    assert(e.limit == "max_steps")
+    assert(e.rules[0] == "document" and e.rules[-1] in ("term", "expression"))
+    assert(e.rule_error.offset <= len(source))
+    assert("max_steps=10000" in str(e))
+
+start = time.monotonic()
+try:
+    c.document.parse(source, limits=ParseLimits(timeout=0.05))
+    assert(False)
+except ParseLimitError as e:
+    assert(e.limit == "timeout")
+assert(time.monotonic() - start < 2)
+
+# deeply nested input
+source = "(" * 200 + "x" + ")" * 200
+try:
+    c.document.parse(source, limits=ParseLimits(max_depth=50))
+    assert(False)
+except ParseLimitError as e:
+    assert(e.limit == "max_depth")
+    assert(len(e.rules) == 51)
+
+# within the limits, the result is the same as without them
+source = "(x + (x + x)) + x"
+limits = ParseLimits(max_steps=1000, timeout=10, max_depth=50, max_nodes=100)
+end, node = c.document.parse(source, limits=limits)
+assert(end == len(source))
+assert(node.__as_dict__() == c.document.parse(source)[1].__as_dict__())
+try:
+    c.document.parse(source, limits=ParseLimits(max_nodes=10))
+    assert(False)
+except ParseLimitError as e:
+    assert(e.limit == "max_nodes")
+
+# a failed match inside the limits is still a regular ParseError
+try:
+    c.document.parse("(x", limits=limits)
+    assert(False)
+except ParseError as e:
+    assert(not isinstance(e, ParseLimitError))
+
+# limits apply to each source on its own
+results = c.document.parse_many(["x + x"] * 10, limits=ParseLimits(max_steps=50))
+assert(len(results) == 10)
@@ -0,0 +1,112 @@
+from rdparser import grammar, ParseError, ParseLimitError
+from rdparser.generator import CorpusGenerator
+from rdparser.nodes import LazyNode
+from rdparser.parallel import parse_parallel
+from rdparser.profile import ChoiceProfile
+from rdparser.rules import ParseLimits
+from rdparser.serialize import dumps_json
+
+# balanced delimiters, skipping over comments
+comment = r"//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/"
+c, b = grammar()
+c.block = b.balanced("{", "}", comment)
+assert(c.block.parse("{ a { b } /* } */ }")[0] == 19)
+assert(c.block.parse(" {}")[1][0].value == "{}")
+for source in ("{ a { b }", "a {}", "{ // }"):
+    try:
+        c.block.parse(source)
+        assert(False)
+    except ParseError:
+        pass
+
+# an ignore regex matching empty text would hide delimiters, or never end
+for ignore in (r"x*", r"\s*", r"(?://[^\n]*)?"):
+    try:
+        b.balanced("{", "}", ignore)
+        assert(False)
+    except ValueError:
+        pass
+
+def build(lazy):
+    c, b = grammar(grammar.builder({comment}))
+    identifier = b({r"[a-zA-Z_][a-zA-Z_0-9]*"})
+    c.type_identifier = identifier + ["<" + (c.type_identifier + ("," + c.type_identifier)[:])["params[]"] + ">"]
+    c.field = identifier + ":" + c.type_identifier + ";"
+    body = "{" + c.field[:]["fields[]"] + "}"
+    if lazy:
+        body = body.lazy("body", b.balanced("{", "}", comment))
+    else:
+        body = body["body"]
+    c.struct = "struct" + identifier + body
+    c.enum = "enum" + identifier + "{" + (identifier + ";")[:] + "}"
+    c.item = c.struct | c.enum
+    c.module = c.item[:]["items[]"] + b.EOS
+    return c
+
+c = build(True)
+eager = build(False)
+source = """
+struct a { x: int; // }
+  y: list<a>; }
+enum e { a; b; }
+struct broken { x: ; }
+struct b { }
+"""
+end, node = c.module.parse(source)
+assert(end == len(source))
+items = node.items
+body = items[0].struct.body
+assert([f[0].value for f in body.fields] == ["x", "y"])
+assert(body.fields[1].type_identifier.params[0][0].value == "a")
+lazy = items[0].struct._inspector.names["body"][0]
+assert(isinstance(lazy, LazyNode) and lazy.loaded)
+assert(lazy.nodes is lazy.nodes)
+assert(not items[2].struct._inspector.names["body"][0].loaded)
+assert(items[3].struct.body.fields == [])
+
+# errors in a lazy region only show up when it's used, every time
+for i in range(2):
+    try:
+        items[2].struct.body
+        assert(False)
+    except ParseError as e:
+        assert(source[e.rule_error.offset:].startswith(" ;"))
+
+# a lazy region is parsed with the same limits, each region on its own budget
+end, node = c.module.parse(source, limits=ParseLimits(max_depth=4))
+try:
+    node.items[0].struct.body
+    assert(False)
+except ParseLimitError as e:
+    assert(e.limit == "max_depth")
+
+# the same tree as parsing everything right away, once it's all loaded
+source = source.replace("struct broken { x: ; }", "")
+lazy_items = c.module.parse(source)[1].items
+eager_items = eager.module.parse(source)[1].items
+assert(len(lazy_items) == len(eager_items) == 3)
+for item, other in zip(lazy_items, eager_items):
+    assert(dumps_json(item) == dumps_json(other))
+
+# recognize only scans lazy regions too
+assert(c.module.recognize("struct a { x: ; }") is not None)
+assert(c.module.recognize("struct a { x: int; ") is None)
+
+# generated documents parse, and choices around lazy rules can be reordered
+source = CorpusGenerator(c.module, seed=3, max_depth=6).generate_string(2000)
+assert(c.module.parse(source)[0] == len(source))
+profile = ChoiceProfile(c.module)
+assert(profile.export() == {"item:0": [0, 1]})
+end, node = c.module.parse(source, profile=profile)
+for item in node.items:
+    if item.struct is not None:
+        item.struct.body
+
+if __name__ == "__main__":
+    # chunks are parsed in other processes, and still load their lazy regions
+    source = "struct a { x: int; y: b<c>; }\nenum e { a; }\n" * 200
+    end, items = parse_parallel(c.item, source, {r"(?m)^(?=struct|enum)"}, "items[]", chunk_size=500)
+    expected = c.module.parse(source)[1].items
+    assert(len(items) == len(expected))
+    for item, other in zip(items, expected):
+        assert(dumps_json(item) == dumps_json(other))
@@ -0,0 +1,152 @@
+import random
+from rdparser import grammar, ParseError
+from rdparser.generator import CorpusGenerator
+from rdparser.profile import ChoiceProfile
+from rdparser.rules import ParseContext, ParseLimits
+
+c, b = grammar()
+c.number = {r"\d+"}
+c.atom = c.number | "(" + c.expr + ")"
+c.expr = b.expression(c.atom,
+    infix={"+": 10, "-": 10, "*": 20, "/": 20, "%": 20, "**": (30, "right")},
+    prefix={"-": 25, "+": 25})
+c.document = c.expr + b.EOS
+
+def to_python(node):
+    # rebuild the expression with every operation in parentheses
+    if node._name == "binary":
+        return "(" + to_python(node.left) + node[0].value + to_python(node.right) + ")"
+    elif node._name == "prefix":
+        return "(" + node[0].value + to_python(node.operand) + ")"
+    elif node._name == "number":
+        return node[0].value
+    for name in ("binary", "prefix", "number", "atom", "expr"):
+        child = getattr(node, name)
+        if child is not None:
+            return to_python(child)
+
+# precedence and associativity are the same as python's
+for source in ["1", "1 + 2 * 3", "2 ** 3 ** 2", "-2 ** 2", "1 - 2 - 3", "2 * -3 ** 2 + 4",
+        "(1 + 2) * 3", "- - 4 / 2 / 2", "7 % 3 * 2", "2 ** -1 ** 2"]:
+    end, node = c.document.parse(source)
+    assert(end == len(source))
+    assert(eval(to_python(node.expr)) == eval(source))
+
+rng = random.Random(0)
+for i in range(200):
+    parts = [str(rng.randint(1, 9))]
+    for j in range(rng.randint(0, 8)):
+        parts.append(rng.choice(["+", "-", "*", "/", "**", "+ -", "* -"]))
+        parts.append(str(rng.randint(1, 3)))
+    source = " ".join(parts)
+    end, node = c.document.parse(source)
+    try:
+        expected = eval(source)
+    except (ZeroDivisionError, OverflowError):
+        continue
+    assert(eval(to_python(node.expr)) == expected)
+
+# binary nodes are flat: a single operand isn't wrapped at all, and each
+# operation is one node with its operator token, and its operands as the
+# `left` and `right` attributes
+end, node = c.document.parse("42")
+assert(node.expr.binary is None and node.expr.atom.number[0].value == "42")
+end, node = c.document.parse("1 + 2 * 3")
+binary = node.expr.binary
+assert(binary[0].value == "+" and len(binary) == 1)
+assert(binary.left.number[0].value == "1")
+assert(binary.right[0].value == "*")
+assert(binary.right.right.number[0].value == "3")
+assert(binary._offset == 0 and binary._end_offset == 9)
+assert(binary.right._offset == 3)
+
+# postfix operators, and operators that are both infix and postfix
+c, b = grammar()
+c.name = {r"[a-z]+"}
+c.expr = b.expression(c.name, infix={"+": 10, "*": 20, "!": 5}, prefix={"-": 15}, postfix={"!": 30, "?": 1})
+c.document = c.expr + b.EOS
+end, node = c.document.parse("a + b!")
+assert(node.expr.binary.right._name == "postfix" and node.expr.binary.right[0].value == "!")
+end, node = c.document.parse("-a!")
+assert(node.expr.prefix.operand[0].value == "!")
+end, node = c.document.parse("a + b?")
+assert(node.expr.postfix[0].value == "?")
+assert(node.expr.postfix.operand[0].value == "+")
+end, node = c.document.parse("a ! b")
+assert(node.expr.binary[0].value == "!")
+end, node = c.document.parse("a!!")
+assert(node.expr.postfix.operand.operand[0].value == "a")
+
+# an operator without an operand after it is left for the rule that follows
+c, b = grammar()
+c.number = {r"\d+"}
+c.expr = b.expression(c.number, infix={"-": 1, "*": 2})
+c.arrow = c.expr + "->" + c.expr
+end, node = c.arrow.parse("1 - 2->3 * 4")
+assert(end == 12)
+assert(node.expr.binary[0].value == "-")
+try:
+    (c.expr + b.EOS)["document"].parse("1 - 2 *")
+    assert(False)
+except ParseError as e:
+    assert(e.rule_error.offset >= 5)
+
+# operators given as rules, like keywords that must end at a word boundary
+c, b = grammar()
+c.name = b({r"[a-z]+"}) - b({r"(and|or|not)\b"})
+c.filter = b.expression(c.name, infix={b({r"or\b"}): 1, b({r"and\b"}): 2, "==": 3},
+    prefix={b({r"not\b"}): 4})
+c.document = c.filter + b.EOS
+end, node = c.document.parse("not a == b or c and order")
+top = node.filter.binary
+assert(top[0].value == "or")
+assert(top.left[0].value == "==" and top.left.left[0].value == "not")
+assert(top.right.right[0].value == "order")
+try:
+    c.document.parse("a andb")
+    assert(False)
+except ParseError:
+    pass
+
+# comments are allowed around operators
+c, b = grammar(b({r"#[^\n]*"}))
+c.number = {r"\d+"}
+c.expr = b.expression(c.number, infix={"+": 1}, prefix={"-": 2})
+c.document = c.expr + b.EOS
+end, node = c.document.parse("1 # one\n + # plus\n - 2 # two")
+assert(node.expr.binary.right[0].value == "-")
+
+# the recognizer and the generator agree with the parser
+c, b = grammar()
+c.number = {r"\d+"}
+c.atom = c.number | "(" + c.expr + ")"
+c.expr = b.expression(c.atom, infix={"+": 1, "-": 1, "*": 2, "**": (3, "right")},
+    prefix={"-": 4}, postfix={"!": 5})
+c.document = c.expr + b.EOS
+generator = CorpusGenerator(c.document, seed=1)
+for i in range(100):
+    source = generator.generate_string()
+    assert(c.document.parse(source)[0] == len(source))
+    assert(c.document.recognize(source) == len(source))
+for source in ["1 +", "1 2", "(1 + 2", "1 ! ! - - 2 ** 3", "1 **", "! 1"]:
+    for rule in (c.document, c.expr):
+        try:
+            expected = rule.parse(source)[0]
+        except ParseError:
+            expected = None
+        assert(rule.recognize(source) == expected)
+ChoiceProfile(c.document)
+
+# the work done grows linearly with the number of operators, counted in the
+# steps and nodes of a parse budget
+def work(count):
+    source = " + ".join("{} * -{} ** 2".format(i, i) for i in range(count))
+    context = ParseContext(limits=ParseLimits())
+    end, error = c.document.rule.match(source, 0, [], context)
+    assert(end == len(source))
+    return context.budget.steps, context.budget.nodes
+
+# every thousand terms adds the same amount of work, even at 10000 terms
+first, second, last = work(1000), work(2000), work(10000)
+for i in range(2):
+    assert(last[i] - first[i] == 9 * (second[i] - first[i]))
@@ -0,0 +1,65 @@
+from rdparser import grammar
+from rdparser.nodes import Node
+from rdparser.parallel import parse_parallel
+
+b = grammar.builder
+single_line_comment = b("//") + {r"[^\n]*"}
+multi_line_comment = b({r"/\*(?:[^*]|\*(?!/))*\*/"})
+c, b = grammar(single_line_comment | multi_line_comment)
+
+identifier = b({r"[a-zA-Z_][a-zA-Z_0-9]*"})
+c.struct_field = identifier + ":" + identifier + ";"
+c.struct_definition = "struct" + identifier + "{" + c.struct_field[:]["fields[]"] + "}"
+c.enum_field = identifier + ";"
+c.enum_definition = "enum" + identifier + "{" + c.enum_field[:]["fields[]"] + "}"
+c.type_definition = c.struct_definition | c.enum_definition
+c.module_body = c.type_definition[:] + b.EOF
+
+item = """
+struct point_{0} {{
+    x: int;
+    y: int; // comment
+}}
+/* a split point inside a comment
+struct is not a real definition
+*/
+enum color_{0} {{ red; green; blue; }}
+"""
+source = "".join(item.format(i) for i in range(200))
+
+def same_tree(a, b):
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        assert(type(a) is type(b) and a.offset == b.offset)
+        if isinstance(a, Node):
+            assert(a.name == b.name and a.end_offset == b.end_offset)
+            assert(len(a.nodes) == len(b.nodes))
+            stack.extend(zip(a.nodes, b.nodes))
+        else:
+            assert(a.value == b.value)
+
+if __name__ == "__main__":
+    end, node = c.module_body.parse(source)
+    expected = node._inspector.target
+    sync = {r"(?m)^(?=struct|enum)"}
+    for max_workers in (1, 2):
+        _end, _node = parse_parallel(c.type_definition, source, sync, "module_body", chunk_size=500, max_workers=max_workers)
+        assert(_end == end)
+        same_tree(_node._inspector.target, expected)
+
+    _end, definitions = parse_parallel(c.type_definition, source, "enum", "definitions[]", chunk_size=2000)
+    assert(len(definitions) == 400)
+    assert(definitions[-1].enum_definition.fields[2][0].value == "blue")
+
+    # a split inside a trailing line comment leaves a chunk that parses, but
+    # ends too early, even when the rest of the comment looks like an item
+    base = "".join(item.format(i) for i in range(8))
+    for comment in ("// the enum below\n", "// enum x { a; }\n"):
+        commented = base + comment + base
+        end, node = c.module_body.parse(commented)
+        for chunk_size in range(1, 3300, 13):
+            _end, _node = parse_parallel(c.type_definition, commented, {r"(?m)enum"}, "module_body",
+                chunk_size=chunk_size, max_workers=1)
+            assert(_end == end)
+            same_tree(_node._inspector.target, node._inspector.target)
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import struct
+import tempfile
+from array import array
+from rdparser import grammar
+from rdparser.nodes import Node, Token
+from rdparser.serialize import dump_json, dumps_json, dump_json_lines, dump_binary, dumps_binary, load_binary, BinaryTree
+
+c, b = grammar()
+
+c.identifier = {r"\w+"}
+c.field = c.identifier["name"] + ":" + c.identifier["type"] + ";"
+c.struct = "struct" + c.identifier + "{" + c.field[:]["fields[]"] + "}"
+
+offset, node = c.struct.parse("struct my_struct { foo:bar; name:string; café:x; }")
+for indent in (None, 2, "\t"):
+    assert(dumps_json(node, indent) == json.dumps(node.__as_dict__(), indent=indent, sort_keys=True))
+
+fp = io.StringIO()
+dump_json_lines([node, node.fields[0]], fp)
+lines = fp.getvalue().splitlines()
+assert(len(lines) == 2 and json.loads(lines[1]) == node.fields[0].__as_dict__())
+
+# deep trees don't hit the recursion limit
+deep = Node(0, "leaf")
+for i in range(10000):
+    parent = Node(0, "nested")
+    parent.nodes.append(deep)
+    deep = parent
+assert(dumps_json(deep).count("nested") == 10000)
+assert(BinaryTree(dumps_binary(deep)).root.to_node().nodes[0].name == "nested")
+
+data = dumps_binary(node)
+tree = BinaryTree(data)
+root = tree.root
+assert(root.name == "struct" and root.offset == 0 and root.end_offset == offset)
+children = [child.name for child in root]
+assert(children == ["identifier", "fields"])
+fields = root.nodes[1]
+assert(fields.opts == {"flatten": True, "as_list": True})
+assert(fields.nodes[2].nodes[0].nodes[0].nodes[0].value == "café")
+assert(json.dumps(root.to_node().__as_dict__()) == json.dumps(node.__as_dict__()))
+
+# a tree written on a machine with the other byte order is swapped on load
+def swap_byte_order(data):
+    data = bytearray(data)
+    header = struct.Struct("<4sBcxxIIQ")
+    magic, version, byteorder, count, table_size, value_size = header.unpack_from(data)
+    data[5:6] = b">" if byteorder == b"<" else b"<"
+    position = header.size + table_size + -table_size % 8
+    for code, length in (("i", count), ("q", count), ("q", count), ("I", count), ("Q", count + 1)):
+        column = array(code)
+        size = column.itemsize * length
+        column.frombytes(data[position:position + size])
+        column.byteswap()
+        data[position:position + size] = column.tobytes()
+        position += size + -size % 8
+    return bytes(data)
+
+swapped = BinaryTree(swap_byte_order(data))
+assert(len(swapped) == len(tree))
+assert(json.dumps(swapped.root.to_node().__as_dict__()) == json.dumps(node.__as_dict__()))
+assert(swapped.root.end_offset == offset)
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "tree.bin")
+    with open(path, "wb") as fp:
+        dump_binary(node, fp)
+    with open(path, "rb") as fp:
+        tree = load_binary(fp)
+        assert(len(tree) == len(BinaryTree(data)))
+        assert(tree.root.nodes[0].nodes[0].value == "my_struct")
+        del tree
@@ -0,0 +1,58 @@
+from rdparser import grammar
+from rdparser.index import TreeIndex
+from rdparser.nodes import Node
+
+c, b = grammar()
+
+identifier = b({r"[a-zA-Z_][a-zA-Z_0-9]*"})
+c.type_identifier = identifier + ["<" + c.type_identifier + ">"]
+c.struct_field = identifier + ":" + c.type_identifier + ";"
+c.struct_definition = "struct" + identifier + "{" + c.struct_field[:]["fields[]"] + "}"
+c.enum_field = identifier + ";"
+c.enum_definition = "enum" + identifier + "{" + c.enum_field[:]["fields[]"] + "}"
+c.type_definition = c.struct_definition | c.enum_definition
+c.module_body = c.type_definition[:] + b.EOF
+
+s = """
+enum color { red; green; }
+struct point { x: int; y: Option<int>; }
+struct line { a: point; b: point; c: int; }
+"""
+end, node = c.module_body.parse(s)
+index = TreeIndex(node)
+
+fields = index.select("struct_definition > struct_field")
+assert([f[0].value for f in fields] == ["x", "y", "a", "b", "c"])
+assert(len(index.select("module_body struct_field")) == 5)
+assert(len(index.select("struct_definition > type_identifier")) == 0)
+assert(len(index.select("struct_definition type_identifier")) == 6)
+assert(len(index.select("type_identifier > type_identifier")) == 1)
+assert([f[0].value for f in index.select("fields > struct_field:first-child")] == ["x", "a"])
+assert([f[0].value for f in index.select("struct_field:last-child, enum_field:nth-child(2)")] == ["green", "y", "c"])
+assert([f[0].value for f in index.select("type_definition:nth-child(-1) struct_field:nth-child(2)")] == ["b"])
+assert(len(index.select("*")) == len(index.nodes))
+
+field = index.find("struct_field")[0]
+assert(index.parent(index.parent(field)).name == "struct_definition")
+assert(index.parent(node) is None)
+assert(index.descendants(field) == index.select_nodes("type_definition:nth-child(2) struct_field:first-child *"))
+
+for selector in ("", "> struct_field", "struct_field:nth-child(0)", "a,", "fields :first-child", "a :nth-child(1)"):
+    try:
+        index.select(selector)
+        assert(False)
+    except ValueError:
+        pass
+
+# descendant steps on a deep tree check every node and step once, instead of
+# every chain of ancestors
+root = Node(0, "b")
+parent = root
+for i in range(300):
+    child = Node(0, "a")
+    parent.nodes.append(child)
+    parent = child
+deep = TreeIndex(root)
+assert(len(deep.select_nodes("b a a a")) == 298)
+assert(len(deep.select_nodes("b > a a > a a")) == 297)
+assert(deep.select_nodes("a b") == [])
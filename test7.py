@@ -0,0 +1,55 @@
+import io
+from rdparser import grammar
+from rdparser.generator import CorpusGenerator
+from rdparser.index import TreeIndex
+
+b = grammar.builder
+single_line_comment = b("//") + {r"[^\n]*"}
+multi_line_comment = b({r"/\*(?:[^*]|\*(?!/))*\*/"})
+c, b = grammar(single_line_comment | multi_line_comment)
+
+def delimited_list(item, separator=","):
+    item = b(item)
+    separator = b(separator)
+    return item + (separator + item)[:]
+
+identifier = b({r"[a-zA-Z_][a-zA-Z_0-9]*"}) - "struct" - "enum"
+end_of_line = (b(";") | ",")[:1]
+
+c.tuple_type = b("(") + [delimited_list(c.type_identifier)] + ")"
+c.type_name_identifier = identifier + ["<" + delimited_list(c.type_identifier)["params[]"] + ">"]
+c.type_identifier = c.tuple_type | c.type_name_identifier
+c.type_name_definition = identifier + ["<" + delimited_list(identifier) + ">"]
+c.struct_field = identifier + ":" + c.type_identifier + end_of_line
+c.struct_definition = "struct" + c.type_name_definition + "{" + c.struct_field[:]["fields[]"] + "}"
+c.enum_field = identifier + [c.tuple_type] + end_of_line
+c.enum_definition = "enum" + c.type_name_definition + "{" + c.enum_field[:]["fields[]"] + "}"
+c.type_definition = c.struct_definition | c.enum_definition
+c.module_body = c.type_definition[:] + b.EOF
+
+# single line comments end at a new line, so separate tokens with new lines
+generator = CorpusGenerator(c.module_body, seed=1, max_depth=8, separator="\n")
+source = generator.generate_string(20000)
+assert(len(source) >= 20000)
+end, node = c.module_body.parse(source)
+assert(end == len(source))
+
+assert(CorpusGenerator(c.module_body, seed=1, max_depth=8, separator="\n").generate_string(20000) == source)
+assert(CorpusGenerator(c.module_body, seed=2, max_depth=8, separator="\n").generate_string(20000) != source)
+
+c, b = grammar()
+c.number = {r"-?(0|[1-9][0-9]*)(\.[0-9]+)?"}
+c.word = {r"\w+"}
+c.value = c.number | c.word | c.list
+c.list = b("[") + [c.value + ("," + c.value)[:]] + "]"
+c.document = c.value[1:] + b.EOS
+
+fp = io.StringIO()
+generator = CorpusGenerator(c.document, seed=3, max_depth=6, regex_samples={r"\w+": ["foo", "bar"]})
+written = generator.generate(fp, 5000)
+source = fp.getvalue()
+assert(written == len(source))
+end, node = c.document.parse(source)
+assert(end == len(source))
+words = TreeIndex(node).find("word")
+assert(words and set(word.nodes[0].value for word in words) <= {"foo", "bar"})
@@ -0,0 +1,73 @@
+from rdparser import grammar
+from rdparser.builder import ParseError
+from rdparser.generator import CorpusGenerator
+
+def check(rule, source):
+    try:
+        expected, node = rule.parse(source)
+    except ParseError:
+        expected = None
+    assert(rule.recognize(source) == expected)
+
+# without recursion, the whole grammar is compiled into a single regex
+c, b = grammar()
+c.email = {r"[a-zA-Z0-9_.]+@[a-zA-Z0-9_.]+"}
+c.phone = {r"\d{3}-\d{3}-\d{4}"}
+c.contact_info = "contact_info(" + (c.email | c.phone) + ")"
+c.contacts = c.contact_info[1:] + b.EOS
+
+assert(c.contacts.recognizer().pattern is not None)
+assert(c.contact_info.recognize("contact_info(800-555-1234)") == 26)
+assert(c.contact_info.recognize("contact_info(800-555-123)") is None)
+assert(c.contacts.recognize("  contact_info( a@b )\ncontact_info(john.doe@example.com) ") == 57)
+for source in ("", "contact_info()", "contact_info(a@b) x", "contact_info(a@b)\ncontact_info(a@b"):
+    check(c.contacts, source)
+
+# recursive grammars fall back to matching rule by rule, without building nodes
+c, b = grammar()
+c.number = {r"-?(0|[1-9][0-9]*)(\.[0-9]+)?"}
+c.word = b({r"\w+"}) - "null"
+c.null = b * "null"
+c.value = c.number | c.null | c.word | c.list
+c.list = b("[") + [c.value + ("," + c.value)[:]] + "]"
+c.document = c.value[1:] + b.EOS
+
+assert(c.document.recognizer().pattern is None)
+for seed in range(20):
+    source = CorpusGenerator(c.document, seed=seed, max_depth=6).generate_string(300)
+    for end in range(0, len(source), 7):
+        check(c.document, source[:end])
+
+assert(c.value.recognize("[1, [null, x]]", explicit_new_lines=True) == 14)
+assert(c.value.recognize("[1,\n 2]", explicit_new_lines=True) is None)
+assert(c.value.recognize("[1,\n 2]") == 7)
+
+# rules of a grammar with a comment rule are the same object every time, so
+# their recognizer is only built once
+c, b = grammar(b({r"#[^\n]*"}))
+c.number = {r"\d+"}
+c.numbers = c.number[1:]
+assert(c.numbers.recognizer() is c.numbers.recognizer())
+assert(c.numbers.recognize("1 # one\n2") == 9)
+
+# cached recognizers don't keep their rule alive
+import gc
+from rdparser.builder import _recognizers
+gc.collect()
+count = len(_recognizers)
+for i in range(100):
+    assert((b({r"\d+"}) + b.balanced("(", ")")).recognize("1 (2)") == 5)
+gc.collect()
+assert(len(_recognizers) <= count)
+
+# assigning a rule again rebuilds the recognizers that use it
+c, b = grammar()
+c.a = "x"
+c.pair = c.a + c.a
+check(c.a, "x")
+check(c.pair, "x x")
+c.a = "y"
+for source in ["x", "y", "x x", "y y"]:
+    check(c.a, source)
+    check(c.pair, source)
+assert(c.a.recognize("y") == 1 and c.pair.recognize("y y") == 3)
@@ -0,0 +1,69 @@
+import threading
+from rdparser import grammar, seal
+from rdparser.builder import ParseError
+from rdparser.rules import use_explicit_new_lines
+
+c, b = grammar()
+c.name = {r"[a-z]+"}
+c.line = c.name[1:]["names[]"] + b * ";"
+c.lines = c.line[1:]["lines[]"] + b.EOS
+seal(c)
+
+# a sealed grammar can't be changed, or grow new rules
+try:
+    c.name = {r"[a-z0-9]+"}
+    assert(False)
+except RuntimeError:
+    pass
+try:
+    c.missing
+    assert(False)
+except AttributeError:
+    pass
+
+# forward declared rules must be assigned before sealing
+c2, b2 = grammar()
+c2.item = c2.value + ","
+try:
+    seal(c2)
+    assert(False)
+except RuntimeError as e:
+    assert("value" in str(e))
+c2.value = {r"\d+"}
+seal(c2)
+assert(c2.item.parse("1,")[0] == 2)
+
+# threads parsing with different new line modes don't affect each other
+source = "foo bar\nbaz;"
+errors = []
+def worker(explicit_new_lines):
+    try:
+        for i in range(200):
+            try:
+                end, node = c.lines.parse(source, explicit_new_lines=explicit_new_lines)
+                assert(not explicit_new_lines and len(node.lines[0].names) == 3)
+            except ParseError:
+                assert(explicit_new_lines)
+    except AssertionError as e:
+        errors.append(e)
+threads = [threading.Thread(target=worker, args=(i % 2 == 0,)) for i in range(8)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+assert(not errors)
+assert(use_explicit_new_lines() is False)
+
+# parse_many keeps the order of its sources
+sources = ["a;" * i + "z;" for i in range(1, 50)]
+results = c.lines.parse_many(sources, max_workers=4)
+assert(len(results) == len(sources))
+for i, (end, node) in enumerate(results):
+    assert(end == len(sources[i]))
+    assert(len(node.lines) == i + 2)
+    assert(node.lines[-1].names[0][0].value == "z")
+try:
+    c.lines.parse_many(["a;", "a"])
+    assert(False)
+except ParseError:
+    pass